@@ -1,23 +1,36 @@
 from fastapi import FastAPI,UploadFile,File,BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
+import json
+import time
+import hashlib
 from data_ingestion.loader import Loader
 from data_ingestion.preprocessor import TextPreprocessor
-from embeddings.openai_embedder import OpenAIEmbedder
+from data_ingestion.pipeline import IngestionPipeline
+from data_ingestion.dedup import ChunkDeduplicator
+from data_ingestion.parallel import ParallelParser
+# from embeddings.openai_embedder import OpenAIEmbedder
 from embeddings.sentence_transformer import SentenceTransformerEmbedder
+from embeddings.cached_embedder import CachedEmbedder
+from embeddings.batcher import MicroBatcher
 from vector_Store.faiss_Store import FaissStore
 # from vector_Store.chromadb_store import ChromaDBStore
-from openai import OpenAI
-from google import genai
+# from openai import OpenAI
 from dotenv import load_dotenv
 import asyncio
+import numpy as np
 from metadata.metadata_Store import MetadataStore
 from retrievers.hybrid_retriever import HybridRetriever
 from retrievers.bm25_retrievers import BM25Retriever
 from rerank.reranker import Reranker
-from filters.metadata_filter import MetadataFilter
+from filters.metadata_index import MetadataIndex
 from memory.memory_manager import MemoryManager
-from typing import List, Dict, Any
+from memory.answer_cache import SemanticAnswerCache
+from app.concurrency import AsyncRWLock, InterProcessLock
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Sequence, Tuple
+from pydantic import BaseModel
 
 
 
@@ -38,7 +51,13 @@ app.add_middleware(
 loader=Loader()
 preprocessor=TextPreprocessor(chunk_size=400,overlap=100)
 # OpenAIEmbedderembedder = OpenAIEmbedder(model_name="text-embedding-3-small")
-sentence_embedder = SentenceTransformerEmbedder(model_name='all-MiniLM-L6-v2')
+EMBEDDING_CACHE_DIR = "embedding_cache"
+sentence_embedder = CachedEmbedder(
+    SentenceTransformerEmbedder(model_name='all-MiniLM-L6-v2'),
+    cache_dir=EMBEDDING_CACHE_DIR,
+)
+# Concurrent query embeddings are coalesced into one batched encode call
+query_batcher = MicroBatcher(sentence_embedder.embed_array, max_batch=32, max_wait_ms=5.0)
 # faiss_store = FaissStore(dimension=384)
 # chromadb_store = ChromaDBStore(persist_dir="chroma_db")
 
@@ -48,107 +67,557 @@ sentence_embedder = SentenceTransformerEmbedder(model_name='all-MiniLM-L6-v2')
 # Initialize Gemini client
 load_dotenv()  # Load environment variables from .env file
 
-gemini_client = genai.Client()
+_gemini_client = None
+
+def get_gemini_client():
+    "Gemini client, created on first use so importing the app stays cheap"
+    global _gemini_client
+    if _gemini_client is None:
+        from google import genai
+        _gemini_client = genai.Client()
+    return _gemini_client
 
 vector_store = None
 VECTOR_STORE_PATH = "vector_store/faiss_index"
-store_lock = asyncio.Lock()  # To ensure thread-safe access to the vector store
+# Exact search while the KB is small, HNSW once it outgrows brute force
+FAISS_INDEX_SPEC = os.getenv("FAISS_INDEX_SPEC", "HNSW32")
+FAISS_MIGRATE_THRESHOLD = int(os.getenv("FAISS_MIGRATE_THRESHOLD", "50000"))
+# Vector storage of new stores: float32, float16, int8 or binary (quantized modes rescore exactly);
+# an existing store keeps the mode it was saved with
+FAISS_STORAGE = os.getenv("FAISS_STORAGE", "float32")
+# Searches share the read side and run in parallel; index mutations take the write side
+store_lock = AsyncRWLock()
+ingest_lock = asyncio.Lock()  # One ingestion at a time keeps each document's chunk range contiguous
+UPLOAD_READ_SIZE = 1024 * 1024  # Bytes copied per read when saving an upload
+EMBED_BATCH_SIZE = 64  # Chunks embedded and added to the stores per step
+COMMIT_BATCH_SIZE = int(os.getenv("COMMIT_BATCH_SIZE", "1024"))  # Chunks embedded and committed together by /uploadfiles/
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or None  # Parser processes for /uploadfiles/ (default: CPU count)
+MAX_BATCH_GENERATIONS = int(os.getenv("MAX_BATCH_GENERATIONS", "16"))  # Gemini calls in flight per batch request
+# Multi-worker serving (RAG_WORKERS > 1, see main.py): every worker maps the same
+# index files. A file lock lets one worker write at a time; it first catches up
+# with the index on disk and saves before releasing, and the other workers
+# notice the new manifest version and remap.
+SHARED_INDEX = int(os.getenv("RAG_WORKERS", "1")) > 1
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "2"))
+writer_lock = InterProcessLock(VECTOR_STORE_PATH + ".writer.lock")
+index_version = None  # manifest version this worker has loaded
 
 metadata_store = MetadataStore()
-bm25_retriever = BM25Retriever(text_chunks=[])
+# BM25 keeps no chunk texts; hits are resolved through the vector store's chunk registry
+bm25_retriever = BM25Retriever(texts=lambda ids: vector_store.get_chunks(ids)[0])
+# Chunk metadata (source, chunk_index, timestamp) -> chunk-id bitmaps, pushed into both retrievers
+metadata_index = MetadataIndex()
+# Repeated chunks (boilerplate, re-uploads) reference the stored copy instead of being embedded again
+deduplicator = ChunkDeduplicator(
+    near_duplicates=os.getenv("DEDUP_NEAR", "0") == "1",
+    threshold=float(os.getenv("DEDUP_NEAR_THRESHOLD", "0.9")),
+)
 hybrid_retriever = None
 reranker=Reranker()
-memory_manager = MemoryManager(short_term_limit=5)
+# Workers don't share memory, so chat history goes to SQLite when there are several
+SESSION_DB = os.getenv("SESSION_DB") or ("vector_store/sessions.db" if SHARED_INDEX else None)
+memory_manager = MemoryManager(short_term_limit=5, db_path=SESSION_DB)
+# Reuses answers for paraphrased questions that retrieve the same chunks; cleared on any corpus change
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+)
+ingestion_pipeline = IngestionPipeline(loader, preprocessor, sentence_embedder, batch_size=EMBED_BATCH_SIZE)
+parallel_parser = ParallelParser(loader, max_workers=PARSE_WORKERS)  # processes start on first multi-file upload
 # metadata_stores = []
 
 
 
+def new_vector_store() -> FaissStore:
+    return FaissStore(
+        dimension=384,
+        index_spec=FAISS_INDEX_SPEC,
+        migrate_threshold=FAISS_MIGRATE_THRESHOLD,
+        chunk_overlap=preprocessor.overlap,
+        storage=FAISS_STORAGE,
+    )
+
+# Models are built lazily; at startup they load and warm up in the background
+# while the index and metadata load, and /readyz reports when all are done
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") == "1"
+readiness = {"index": False, "metadata": False, "embedder": False, "reranker": False}
+model_loading = None
+index_building = None
+
 @app.on_event("startup")
+async def startup():
+    global model_loading, index_building
+    started = time.perf_counter()
+    if PRELOAD_MODELS:
+        model_loading = asyncio.create_task(load_models())
+    else:
+        readiness["embedder"] = readiness["reranker"] = True  # loaded by the first request instead
+    await asyncio.gather(asyncio.to_thread(load_faiss_index), asyncio.to_thread(load_metadata))
+    print(f"✅ Index mapped and metadata opened in {time.perf_counter() - started:.2f}s.")
+    # BM25, the metadata index and the deduplicator are O(corpus) to rebuild:
+    # connections are accepted meanwhile and /readyz reports 503 until done
+    index_building = asyncio.create_task(build_search_indexes())
+
+@app.on_event("shutdown")
+def stop_parser_pool():
+    parallel_parser.shutdown()
+
+async def load_models():
+    async def warm(name, model):
+        try:
+            started = time.perf_counter()
+            await asyncio.to_thread(model.load)
+            await asyncio.to_thread(model.warmup)
+            readiness[name] = True
+            print(f"✅ {name} loaded and warmed up in {time.perf_counter() - started:.2f}s.")
+        except Exception as e:
+            print(f"⚠️ Failed to load {name}: {e}")
+    await asyncio.gather(warm("embedder", sentence_embedder), warm("reranker", reranker))
+
+def load_metadata():
+    metadata_store.load()
+    readiness["metadata"] = True
+
 def load_faiss_index():
     """Load FAISS index once at startup if exists."""
-    global vector_store, bm25_retriever, hybrid_retriever
-    vector_store = FaissStore(dimension=384)
+    global vector_store, bm25_retriever, hybrid_retriever, index_version
+    vector_store = new_vector_store()
 
-    if os.path.exists(VECTOR_STORE_PATH + ".index"):
+    if FaissStore.exists(VECTOR_STORE_PATH):
         try:
-            vector_store.load(VECTOR_STORE_PATH)
+            index_version = FaissStore.stored_version(VECTOR_STORE_PATH)
+            # Another worker may be mid-write: only a lock holder may clean up its files
+            vector_store.load(VECTOR_STORE_PATH, recover=not SHARED_INDEX)
             print("✅ FAISS index loaded successfully at startup.")
         except Exception as e:
             print(f"⚠️ Failed to load FAISS index: {e}")
     else:
         print("ℹ️ No existing FAISS index found. Will create a new one.")
 
-    hybrid_retriever = HybridRetriever(vector_store, bm25_retriever, alpha=0.5)   
+    hybrid_retriever = HybridRetriever(vector_store, bm25_retriever, alpha=0.5)
+
+async def build_search_indexes():
+    """Index the loaded store in BM25, the metadata index and the deduplicator, in the background."""
+    started = time.perf_counter()
+    try:
+        async with ingest_lock:
+            async with store_lock.write():
+                await asyncio.to_thread(sync_search_indexes, vector_store)
+        readiness["index"] = True
+        print(f"✅ Search indexes built in {time.perf_counter() - started:.2f}s.")
+    except Exception as e:
+        print(f"⚠️ Failed to build search indexes: {e}")
+    if SHARED_INDEX:
+        asyncio.create_task(watch_index())
+
+def sync_search_indexes(store: FaissStore):
+    """
+    BM25, the metadata index and the deduplicator live in memory only: index
+    the live chunks of a (re)loaded store they haven't seen yet, and drop from
+    BM25 and the deduplicator the ones deleted or compacted away (the metadata
+    index only narrows searches, so stale entries there are harmless).
+    """
+    ids = store.ids_of(np.arange(len(store.texts)))
+    live = ~np.isin(ids, list(store.deleted_ids))
+    gone = set(bm25_retriever.chunk_ids) - bm25_retriever.deleted_ids - set(ids[live].tolist())
+    if gone:
+        bm25_retriever.delete(gone)
+    new = [row for row in np.flatnonzero(live).tolist() if ids[row] not in bm25_retriever]
+    if new:
+        bm25_retriever.add_documents([store.texts[row] for row in new], ids[new])
+        print(f"✅ BM25 index updated with {len(new)} chunks.")
+    unindexed = [row for row in np.flatnonzero(live).tolist() if ids[row] not in metadata_index]
+    if unindexed:
+        metadata_index.add(ids[unindexed], [store.metadata[row] for row in unindexed])
+    live_ids = set(ids[live].tolist())
+    stale = deduplicator.ids - live_ids
+    if stale:
+        deduplicator.remove(stale)
+    unhashed = [row for row in np.flatnonzero(live).tolist() if ids[row] not in deduplicator]
+    if unhashed:
+        deduplicator.add(ids[unhashed], [store.texts[row] for row in unhashed])
+
+def add_chunks(chunks: List[str], embeddings, metadata: List[dict]) -> np.ndarray:
+    """
+    Add chunks to the vector store and the in-memory indexes. Runs in a worker
+    thread with store_lock held for writing, so tokenizing and hashing a batch
+    doesn't stall the event loop (and every other request) while it runs.
+    """
+    chunk_ids = vector_store.add(chunks, embeddings, metadata)
+    bm25_retriever.add_documents(chunks, chunk_ids)
+    metadata_index.add(chunk_ids, metadata)
+    deduplicator.add(chunk_ids, chunks)
+    return chunk_ids
+
+def remove_chunks(chunk_ids: List[int]) -> int:
+    """Tombstone chunks in the vector store and the in-memory indexes. Call with store_lock held for writing."""
+    removed = vector_store.delete(chunk_ids)
+    bm25_retriever.delete(chunk_ids)
+    deduplicator.remove(chunk_ids)
+    answer_cache.invalidate()
+    return removed
+
+async def discard_unowned(start_idx: int):
+    """
+    Tombstone the chunks added from start_idx on: an upload failed before a
+    document row took ownership of them, so DELETE /documents/ can't reach them.
+    """
+    chunk_ids = list(range(start_idx, vector_store.next_id))
+    if chunk_ids:
+        async with store_lock.write():
+            remove_chunks(chunk_ids)
+        print(f"🧹 Discarded {len(chunk_ids)} chunks of a failed upload")
+
+def persist_vector_store():
+    """Append the new chunks as a segment, compacting once segments pile up."""
+    global index_version
+    vector_store.save(VECTOR_STORE_PATH)
+    if vector_store.needs_compaction():
+        vector_store.compact()
+    index_version = FaissStore.stored_version(VECTOR_STORE_PATH)
+
+async def refresh_index(recover: bool = False) -> bool:
+    """
+    Remap the index if another worker saved a newer version. The new store
+    is loaded beside the current one, so searches only wait for the swap.
+    Call with ingest_lock held.
+    """
+    global vector_store, index_version
+    version = await asyncio.to_thread(FaissStore.stored_version, VECTOR_STORE_PATH)
+    if version is None or version == index_version:
+        return False
+    store = new_vector_store()
+    await asyncio.to_thread(store.load, VECTOR_STORE_PATH, recover)
+    async with store_lock.write():
+        await asyncio.to_thread(sync_search_indexes, store)
+        vector_store = store
+        hybrid_retriever.vector_store = store
+        index_version = version
+        answer_cache.invalidate()
+    print(f"🔁 Index refreshed to version {version}.")
+    if bm25_retriever.needs_compaction():
+        async with store_lock.read():
+            state = await asyncio.to_thread(bm25_retriever.prepare_compaction)
+        async with store_lock.write():
+            bm25_retriever.apply_compaction(state)
+    return True
+
+async def watch_index():
+    "Multi-worker mode: pick up index versions saved by other workers"
+    while True:
+        await asyncio.sleep(INDEX_POLL_SECONDS)
+        if ingest_lock.locked():
+            continue  # this worker is writing and will be current afterwards
+        try:
+            async with ingest_lock:
+                await refresh_index()
+        except Exception as e:
+            print(f"⚠️ Failed to refresh FAISS index: {e}")
+
+@asynccontextmanager
+async def index_writer():
+    """
+    Exclusive right to modify the index and the metadata store. With several
+    workers this also holds the cross-process writer lock, catches up with
+    what other workers saved, and saves before releasing.
+    """
+    async with ingest_lock:
+        if not SHARED_INDEX:
+            yield
+            return
+        async with writer_lock.hold():
+            await asyncio.to_thread(FaissStore.recover_files, VECTOR_STORE_PATH)
+            await refresh_index(recover=True)
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(persist_vector_store)
 
 @app.get("/")
 async def root():
     return {"message":"Welcome to RAG API"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: index, metadata and models are loaded (503 until then)."""
+    ready = all(readiness.values())
+    return JSONResponse({"ready": ready, "components": readiness}, status_code=200 if ready else 503)
+
+async def save_upload(file: UploadFile, tag_with_hash: bool = False) -> Tuple[str, str]:
+    """
+    Stream an upload to disk instead of holding it in memory, hashing it on the
+    way; returns (path, sha256). tag_with_hash puts the start of the hash into
+    the stored name, so files sharing a name don't overwrite each other.
+    """
+    file_location=os.path.join("uploads_files",file.filename)
+    os.makedirs(loader.upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    partial = file_location + ".part"
+    with open(partial,"wb") as f:
+        while True:
+            data = await file.read(UPLOAD_READ_SIZE)
+            if not data:
+                break
+            f.write(data)
+            digest.update(data)
+    content_hash = digest.hexdigest()
+    if tag_with_hash:
+        stem, extension = os.path.splitext(file_location)
+        file_location = f"{stem}-{content_hash[:12]}{extension}"
+    os.replace(partial, file_location)
+    return file_location, content_hash
+
+def duplicate_upload(filename: str, file_location: str, existing: Dict[str, Any]) -> Dict[str, Any]:
+    """Response for a file whose content is already stored; the redundant copy is removed."""
+    if os.path.abspath(existing["path"] or "") != os.path.abspath(file_location):
+        os.remove(file_location)
+    return {
+        "message": "ℹ️ File already ingested; returning the existing document.",
+        "filename": filename,
+        "doc_id": existing["id"],
+        "duplicate_of": existing["filename"],
+        "num_chunks": existing["num_chunks"],
+    }
+
 @app.post("/uploadfile/")
 async def upload_file(file:UploadFile=File(...), background_tasks: BackgroundTasks =None):
     "upload a file and return the chunks"
     global vector_store
     # global metadata_stores
     #save the file
-    file_location=os.path.join("uploads_files",file.filename)
-    os.makedirs(loader.upload_dir, exist_ok=True)
-
-    content = await file.read()
-
-    with open(file_location,"wb") as f:
-        f.write(content)
-    #load the file
-    raw_text = await asyncio.to_thread(loader.load_files, file_location)
-    # raw_text=loader.load_files(file_location)
-    #clean and chunk
-    chunks = await asyncio.to_thread(preprocessor.chunk_text, raw_text)
-    #embed the chunks
-    # embeddings = OpenAIEmbedderembedder.embed(chunks)
-    sentence_embeddings = await asyncio.to_thread(sentence_embedder.embed,chunks)
-
-    #store the chunks and embeddings
-    metadata = [{"source": file.filename, "chunk_index": i} for i in range(len(chunks))]
-    # faiss_store.add(chunks, sentence_embeddings, metadata)
-    # vector_store.add(chunks, sentence_embeddings, metadata)
-    # vector_store.save(VECTOR_STORE_PATH)
-    async with store_lock:
-        start_idx = len(vector_store.texts)
-        vector_store.add(chunks,sentence_embeddings, metadata)
-        bm25_retriever.add_documents(chunks)
-        end_idx = len(vector_store.texts)
-        background_tasks.add_task(vector_store.save, VECTOR_STORE_PATH)
-
-    # chromadb_store.add(chunks, sentence_embeddings, metadata)
-
-    #save the stores
-    # faiss_store.save("faiss_store/faiss_index")
-    # faiss_store.save("C:/temp_faiss/faiss_index")
-
-    doc_id = metadata_store.add_document(
-        filename=file.filename,
-        num_chunks=len(chunks),
-        path=file_location,
-        start_idx=start_idx,
-        end_idx=end_idx,
-    )
+    file_location, content_hash = await save_upload(file)
+
+    #load, clean, chunk and embed page by page; each batch becomes searchable
+    #as soon as it is added, and the store lock is only held per batch
+    num_chunks = 0
+    shared_chunk_ids: List[int] = []
+    uploaded_at = time.time()
+    async with index_writer():
+        # The same file under any name is only ingested once
+        existing = metadata_store.find_by_hash(content_hash)
+        if existing:
+            return duplicate_upload(file.filename, file_location, existing)
+
+        start_idx = vector_store.next_id
+        try:
+            batches = ingestion_pipeline.iter_unique_batches(file_location, deduplicator)
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                chunks, sentence_embeddings, duplicates = batch
+                shared_chunk_ids.extend(duplicates)
+                if not chunks:
+                    continue
+                metadata = [{"source": file.filename, "chunk_index": num_chunks + i, "timestamp": uploaded_at}
+                            for i in range(len(chunks))]
+                async with store_lock.write():
+                    await asyncio.to_thread(add_chunks, chunks, sentence_embeddings, metadata)
+                    answer_cache.invalidate()
+                num_chunks += len(chunks)
+            # Chunk ids are contiguous per document while the index writer is held
+            end_idx = vector_store.next_id
+            doc_id = metadata_store.add_document(
+                filename=file.filename,
+                num_chunks=num_chunks,
+                path=file_location,
+                start_idx=start_idx,
+                end_idx=end_idx,
+                content_hash=content_hash,
+                shared_chunk_ids=shared_chunk_ids,
+            )
+        except Exception:
+            # Batches already added would stay searchable with no document to delete them by
+            await discard_unowned(start_idx)
+            raise
+    if not SHARED_INDEX:  # the shared writer has saved already
+        background_tasks.add_task(persist_vector_store)
 
     return {
         "message": "✅ File processed and stored successfully.",
         "filename": file.filename,
         "doc_id": doc_id,
-        "num_chunks": len(chunks),
+        "num_chunks": num_chunks,
+        "duplicate_chunks": len(shared_chunk_ids),
+    }
+
+@app.post("/uploadfiles/")
+async def upload_files(files: List[UploadFile] = File(...), background_tasks: BackgroundTasks = None):
+    """
+    Ingest many files in one request (e.g. an unpacked archive). Files are
+    parsed in a process pool, large PDFs split into page ranges, while the
+    files already parsed are chunked and embedded; chunks are committed to the
+    stores COMMIT_BATCH_SIZE at a time.
+    """
+    saved: List[Tuple[str, str, str]] = []
+    for file in files:
+        # A name already used in this request gets a hash-tagged path instead of overwriting
+        repeated = any(filename == file.filename for filename, _, _ in saved)
+        saved.append((file.filename, *await save_upload(file, tag_with_hash=repeated)))
+    results: List[Optional[Dict[str, Any]]] = [None] * len(saved)
+    uploaded_at = time.time()
+
+    async with index_writer():
+        # ----- Whole-file dedup, against the store and within the request -----
+        to_parse, first_seen = [], {}
+        for i, (filename, path, content_hash) in enumerate(saved):
+            existing = metadata_store.find_by_hash(content_hash)
+            if existing:
+                results[i] = duplicate_upload(filename, path, existing)
+            elif content_hash in first_seen:
+                first_path = saved[first_seen[content_hash]][1]
+                if os.path.abspath(first_path) != os.path.abspath(path):
+                    os.remove(path)
+                results[i] = {"filename": filename, "duplicate_of": saved[first_seen[content_hash]][0]}
+            else:
+                first_seen[content_hash] = i
+                to_parse.append(i)
+
+        # ----- Chunk parsed files into one pending batch, committed in large steps -----
+        pending_chunks: List[str] = []
+        pending_metadata: List[dict] = []
+        pending_ids: Dict[str, int] = {}  # chunk text -> its id (assigned or committed), for repeats within the request
+        finished: List[Tuple[int, dict]] = []  # documents whose chunks are all pending or committed
+        owned_idx = vector_store.next_id  # chunks below this belong to a stored document
+
+        async def commit():
+            nonlocal owned_idx
+            if pending_chunks:
+                embeddings = await asyncio.to_thread(sentence_embedder.embed_array, pending_chunks)
+                async with store_lock.write():
+                    await asyncio.to_thread(add_chunks, pending_chunks, embeddings, pending_metadata)
+                    answer_cache.invalidate()
+                pending_chunks.clear()
+                pending_metadata.clear()
+            with metadata_store.batch():
+                for i, doc in finished:
+                    doc_id = metadata_store.add_document(**doc)
+                    results[i] = {"filename": saved[i][0], "doc_id": doc_id, "num_chunks": doc["num_chunks"],
+                                  "duplicate_chunks": len(doc["shared_chunk_ids"])}
+            if finished:
+                owned_idx = finished[-1][1]["end_idx"]
+            finished.clear()
+
+        documents = parallel_parser.iter_documents([saved[i][1] for i in to_parse])
+        try:
+            for i in to_parse:
+                filename, path, content_hash = saved[i]
+                _, pieces = await asyncio.to_thread(next, documents)
+                if isinstance(pieces, Exception):
+                    results[i] = {"filename": filename, "error": str(pieces)}
+                    continue
+                chunks = await asyncio.to_thread(lambda: list(preprocessor.chunk_stream(pieces)))
+                start_idx = vector_store.next_id + len(pending_chunks)
+                num_chunks, shared = 0, []
+                # pending_ids keeps its ids across commits: found was computed before
+                # chunks still pending (or committed meanwhile) reached the deduplicator
+                found = await asyncio.to_thread(deduplicator.find, chunks)
+                for chunk, existing in zip(chunks, found):
+                    if existing is None:
+                        existing = pending_ids.get(chunk)
+                    if existing is not None:
+                        shared.append(existing)
+                        continue
+                    pending_ids[chunk] = vector_store.next_id + len(pending_chunks)
+                    pending_chunks.append(chunk)
+                    pending_metadata.append({"source": filename, "chunk_index": num_chunks, "timestamp": uploaded_at})
+                    num_chunks += 1
+                    if len(pending_chunks) >= COMMIT_BATCH_SIZE:
+                        await commit()
+                finished.append((i, {
+                    "filename": filename, "num_chunks": num_chunks, "path": path,
+                    "start_idx": start_idx, "end_idx": start_idx + num_chunks,
+                    "content_hash": content_hash, "shared_chunk_ids": shared,
+                }))
+            await commit()
+        except Exception:
+            # Committed chunks of documents not stored yet would be unreachable by DELETE
+            await discard_unowned(owned_idx)
+            raise
+            finished.append((i, {
+                "filename": filename, "num_chunks": num_chunks, "path": path,
+                "start_idx": start_idx, "end_idx": start_idx + num_chunks,
+                "content_hash": content_hash, "shared_chunk_ids": shared,
+            }))
+        await commit()
+
+    if not SHARED_INDEX:  # the shared writer has saved already
+        background_tasks.add_task(persist_vector_store)
+    return {
+        "message": f"✅ Processed {len(saved)} files.",
+        "files": results,
+    }
+
+@app.get("/stats/")
+async def stats():
+    """Cache hit/miss counters."""
+    return {
+        "embedding_cache": sentence_embedder.stats(),
+        "query_batching": query_batcher.stats(),
+        "reranker": reranker.stats(),
+        "answer_cache": answer_cache.stats(),
+        "dedup": deduplicator.stats(),
+        "chunk_registry": vector_store.texts.stats() if vector_store is not None else None,
+        "store_lock": store_lock.stats(),
     }
 
 @app.get("/documents/")
-async def list_documents():
-    """List all uploaded documents and their metadata."""
-    return metadata_store.list_documents()
+async def list_documents(limit: Optional[int] = None, offset: int = 0):
+    """List uploaded documents and their metadata (paginated with limit/offset)."""
+    return metadata_store.list_documents(limit=limit, offset=offset)
+
+@app.get("/chunks/{chunk_id}")
+async def get_chunk(chunk_id: int):
+    """A chunk's text and metadata, with the document it belongs to."""
+    async with store_lock.read():
+        # Deleted chunks stay resolvable in the store until compaction drops them
+        if chunk_id in vector_store.deleted_ids:
+            return {"error": f"Chunk {chunk_id} not found."}
+        texts, metadata = vector_store.get_chunks([chunk_id])
+    if texts[0] is None:
+        return {"error": f"Chunk {chunk_id} not found."}
+    return {"id": chunk_id, "text": texts[0], "metadata": metadata[0],
+            "document": metadata_store.document_for_chunk(chunk_id)}
+
+async def compact_bm25():
+    """
+    Drop tombstoned chunks from the BM25 corpus once enough have piled up.
+    The compacted index is built while searches keep running; only the swap is exclusive.
+    """
+    async with ingest_lock:  # no chunks may be added between prepare and apply
+        if not bm25_retriever.needs_compaction():
+            return
+        async with store_lock.read():
+            state = await asyncio.to_thread(bm25_retriever.prepare_compaction)
+        async with store_lock.write():
+            bm25_retriever.apply_compaction(state)
 
 @app.delete("/documents/{doc_id}")
-async def delete_document(doc_id: str):
-    """Delete document metadata (does not remove from FAISS yet)."""
-    metadata_store.delete_document(doc_id)
-    return {"message": f"🗑️ Document {doc_id} metadata deleted."}
+async def delete_document(doc_id: str, background_tasks: BackgroundTasks):
+    """Delete a document: its chunks leave search results immediately and are reclaimed on compaction."""
+    async with index_writer():
+        doc = metadata_store.get_document(doc_id)
+        if not doc:
+            return {"error": f"Document {doc_id} not found."}
+
+        # Chunks other documents still own or reference (deduplicated content) stay
+        candidates = set(range(doc["start_idx"], doc["end_idx"])) | set(metadata_store.shared_chunks(doc_id))
+        chunk_ids = sorted(candidates - metadata_store.chunks_in_use(candidates, doc_id))
+        async with store_lock.write():
+            removed = remove_chunks(chunk_ids)
+        metadata_store.delete_document(doc_id)
+
+    # Persist the tombstones (and compact if due) off the request path
+    if not SHARED_INDEX:
+        background_tasks.add_task(persist_vector_store)
+    background_tasks.add_task(compact_bm25)
+    return {"message": f"🗑️ Document {doc_id} deleted.", "chunks_removed": removed}
 
 @app.get("/search/")
 async def search_KB(query:str):
@@ -158,7 +627,7 @@ async def search_KB(query:str):
     global vector_store
     if vector_store is None:
         vector_store = FaissStore(dimension=384)
-        if os.path.exists(VECTOR_STORE_PATH + ".index"):
+        if FaissStore.exists(VECTOR_STORE_PATH):
             try:
                 vector_store.load(VECTOR_STORE_PATH)
                 print("✅ FAISS index loaded successfully.")
@@ -168,7 +637,7 @@ async def search_KB(query:str):
             return {"error": "No FAISS index found. Please upload a file first."}
     #embed the query   
     "search the KB for similar chunks"
-    query_embedding = sentence_embedder.embed([query])[0]
+    query_embedding = await query_batcher.submit(query)
     results, metadata = vector_store.search(query_embedding, top_k=1)
     return {
         "query": query,
@@ -181,7 +650,7 @@ async def search_KB(query:str):
 #     global vector_store
 #     if vector_store is None:
 #         vector_store = FaissStore(dimension=384)
-#         if os.path.exists(VECTOR_STORE_PATH + ".index"):
+#         if FaissStore.exists(VECTOR_STORE_PATH):
 #             try:
 #                 vector_store.load(VECTOR_STORE_PATH)
 #                 print("✅ FAISS index loaded successfully.")
@@ -228,7 +697,7 @@ async def generate_response(query:str):
     global vector_store
     if vector_store is None:
         vector_store = FaissStore(dimension=384)
-        if os.path.exists(VECTOR_STORE_PATH + ".index"):
+        if FaissStore.exists(VECTOR_STORE_PATH):
             try:
                 vector_store.load(VECTOR_STORE_PATH)
                 print("✅ FAISS index loaded successfully.")
@@ -238,10 +707,9 @@ async def generate_response(query:str):
             return {"error": "No FAISS index found. Please upload a file first."}
         
     # Assuming sentence_embedder is initialized correctly
-    query_embedding = await asyncio.to_thread(sentence_embedder.embed,[query])
-    query_embedding = query_embedding[0]  # Get the first (and only) embedding
-    async with store_lock:
-        results, metadata = await asyncio.to_thread(vector_store.search,query_embedding, top_k=3)
+    cache_version = answer_cache.corpus_version
+    query_embedding = await query_batcher.submit(query)
+    chunk_ids, results = await retrieve_chunks(query, query_embedding, "vector", top_k=3)
 
     context = "\n".join(results)
     prompt = f"""
@@ -256,51 +724,73 @@ async def generate_response(query:str):
 
     Answer:
     """
-    
-    # --- CORRECTED GEMINI API CALL ---
-    completion = await asyncio.to_thread(gemini_client.models.generate_content,
-        model="gemini-2.5-flash",
-        # 1. Use 'contents' instead of 'messages'
-        contents=prompt, 
-        # 2. Pass temperature and other parameters via 'config'
-        config={"temperature": 0.3}
-    )
 
-
-    # 3. Access the response text via the '.text' property
-    answer = completion.text.strip()
+    answer, cached = await generate_cached(prompt, query_embedding, chunk_ids, ("generate_gemini",), cache_version)
 
     return {
         "query": query,
         "answer": answer,
-        "retrieved_context": results
+        "retrieved_context": results,
+        "cached": cached,
     }
 
 
+def retrieve_hits(query: str, query_emb, mode: str, top_k: int, filter_query: Optional[Dict[str, Any]] = None,
+                  alpha: Optional[float] = None) -> Optional[Tuple[List[int], List[str]]]:
+    """
+    Chunk ids and texts of the top_k chunks for the query, or None for an unknown mode.
+    filter_query (see MetadataIndex) restricts the search itself, so top_k matching chunks come back.
+    """
+    allowed = metadata_index.bitmap(filter_query)
+    if mode == "hybrid":
+        # Hybrid search
+        hits = hybrid_retriever.search(query_emb, query, top_k=top_k, alpha=alpha, allowed=allowed)
+        return [hit["id"] for hit in hits], [hit["text"] for hit in hits]
+    if mode == "vector":
+        # Semantic search
+        ids, _ = vector_store.search_ids(query_emb, top_k, allowed)
+    elif mode == "bm25":
+        # Lexical search
+        ids, _ = bm25_retriever.retrieve_ids(query, top_k=top_k, allowed=allowed)
+    else:
+        return None
+    texts, _ = vector_store.get_chunks(ids)
+    found = [i for i, text in enumerate(texts) if text is not None]
+    return [int(ids[i]) for i in found], [texts[i] for i in found]
+
+async def retrieve_chunks(query: str, query_emb, mode: str, top_k: int = 3) -> Optional[Tuple[List[int], List[str]]]:
+    """(chunk ids, texts) of the context for the /query/ endpoints, or None for an unknown mode."""
+    async with store_lock.read():
+        return await asyncio.to_thread(retrieve_hits, query, query_emb, mode, top_k)
+
+async def generate_cached(prompt, query_emb, chunk_ids: List[int], namespace, cache_version: int) -> Tuple[str, bool]:
+    """Gemini answer for the prompt, served from the semantic answer cache when possible."""
+    answer = answer_cache.lookup(query_emb, chunk_ids, namespace)
+    if answer is not None:
+        return answer, True
+
+    started = time.perf_counter()
+    completion = await asyncio.to_thread(get_gemini_client().models.generate_content,
+        model="gemini-2.5-flash",
+        contents=prompt,
+        config={"temperature": 0.3}
+    )
+    answer = completion.text.strip()
+    answer_cache.store(query_emb, chunk_ids, answer, namespace, time.perf_counter() - started, cache_version)
+    return answer, False
+
 @app.get("/query/")
 async def query_rag(query: str, mode: str = "hybrid"):
     global vector_store, bm25_retriever
     if vector_store is None or not vector_store.texts:
         return {"error": "No vector store or documents available. Please upload a file first."}
 
-    query_emb = await asyncio.to_thread(sentence_embedder.embed, [query])
-    query_emb = query_emb[0]
-
-    async with store_lock:
-        if mode == "vector":
-            # Semantic search
-            top_chunks, _ = await asyncio.to_thread(vector_store.search, query_emb, top_k=3)
-        
-        elif mode == "bm25":
-            # Lexical search
-            top_chunks, _ = await asyncio.to_thread(bm25_retriever.retrieve, query, top_k=3)
-        
-        elif mode == "hybrid":
-            # Hybrid search
-            top_chunks = await asyncio.to_thread(hybrid_retriever.retrieve, query_emb, query, top_k=3)
-        
-        else:
-            return {"error": "Invalid mode. Choose vector, bm25, or hybrid."}
+    cache_version = answer_cache.corpus_version
+    query_emb = await query_batcher.submit(query)
+    retrieved = await retrieve_chunks(query, query_emb, mode, top_k=3)
+    if retrieved is None:
+        return {"error": "Invalid mode. Choose vector, bm25, or hybrid."}
+    chunk_ids, top_chunks = retrieved
 
     context = "\n\n".join(top_chunks)
     prompt = f"""
@@ -315,57 +805,47 @@ async def query_rag(query: str, mode: str = "hybrid"):
 
     Answer:
     """
-    
-    # --- CORRECTED GEMINI API CALL ---
-    completion = await asyncio.to_thread(gemini_client.models.generate_content,
-        model="gemini-2.5-flash",
-        # 1. Use 'contents' instead of 'messages'
-        contents=prompt, 
-        # 2. Pass temperature and other parameters via 'config'
-        config={"temperature": 0.3}
-    )
 
-
-    # 3. Access the response text via the '.text' property
-    answer = completion.text.strip()
+    answer, cached = await generate_cached(prompt, query_emb, chunk_ids, ("query", mode), cache_version)
 
     return {
         "mode": mode,
         "query": query,
         "answer": answer,
-        "retrieved_context": top_chunks
+        "retrieved_context": top_chunks,
+        "cached": cached,
     }
 
 
+async def rerank_docs(query: str, docs: List[str], doc_ids: Sequence[int], llm: bool, top_k: int = 5) -> List[str]:
+    """
+    Top-k of the retrieved chunks by the cross-encoder, or by the LLM reranker
+    when llm is set (batches it fails on are scored by the cross-encoder).
+    """
+    if llm:
+        documents = [{"id": int(doc_id), "text": doc} for doc_id, doc in zip(doc_ids, docs)]
+        ranked = await reranker.allm_rerank(query, documents, top_k=top_k)
+        return [doc["text"] for doc in ranked]
+    reranked = await reranker.arerank(query, docs, top_k=top_k, ids=doc_ids)
+    return [doc for doc, _ in reranked]
+
 @app.get("/query with reranker & metadata/")
 async def query_rag(
     query: str, 
     mode: str = "hybrid", 
     filter_source: str = None, 
-    rerank: bool = True
+    rerank: bool = True,
+    llm_rerank: bool = False
 ):
     global vector_store, bm25_retriever, metadata_store
 
-    query_emb = sentence_embedder.embed([query])[0]
-
-    # ----- Retrieval -----
-    if mode == "vector":
-        candidates = vector_store.search(query_emb, top_k=10)
+    query_emb = await query_batcher.submit(query)
 
-    elif mode == "bm25":
-        candidates, _ = bm25_retriever.retrieve(query, top_k=10)
-
-    elif mode == "hybrid":
-        hybrid = HybridRetriever(vector_store, bm25_retriever, alpha=0.6)
-        candidates = hybrid.retrieve(query_emb, query, top_k=10)
-
-    # ----- Metadata Filter -----
-    if filter_source:
-        mf = MetadataFilter(metadata_store)
-        candidates = mf.filter(
-            candidates,
-            {"source": filter_source}
-        )
+    # ----- Retrieval, restricted to the metadata filter -----
+    filter_query = {"source": filter_source} if filter_source else None
+    async with store_lock.read():
+        hits = await asyncio.to_thread(retrieve_hits, query, query_emb, mode, 10, filter_query, 0.6)
+    candidate_ids, candidates = hits or ([], [])
 
     # If no results after filtering
     if not candidates:
@@ -373,8 +853,7 @@ async def query_rag(
 
     # ----- Reranking -----
     if rerank:
-        reranked = reranker.rerank(query, candidates, top_k=5)
-        ranked_docs = [doc for doc, _ in reranked]
+        ranked_docs = await rerank_docs(query, candidates, candidate_ids, llm_rerank)
     else:
         ranked_docs = candidates[:5]
 
@@ -394,7 +873,7 @@ async def query_rag(
     """
     
     # --- CORRECTED GEMINI API CALL ---
-    completion = await asyncio.to_thread(gemini_client.models.generate_content,
+    completion = await asyncio.to_thread(get_gemini_client().models.generate_content,
         model="gemini-2.5-flash",
         # 1. Use 'contents' instead of 'messages'
         contents=prompt, 
@@ -411,63 +890,140 @@ async def query_rag(
         "retrieved": ranked_docs,
         "metadata_filter": filter_source,
         "reranking": rerank,
+        "llm_rerank": llm_rerank,
         "mode": mode
     }
 
 
 
 
-@app.post("/chat/")
-async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bool=True, filter_source:str=None):
-    """
-    Chat endpoint with:
-    - Short-term memory (per session)
-    - Long-term memory (FAISS RAG)
-    - Hybrid retrieval + reranking
-    - Gemini LLM generation
-    """
-    global memory_manager, vector_store, bm25_retriever, metadata_store
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    mode: str = "hybrid"
+    top_k: int = 3
+    filter: Optional[Dict[str, Any]] = None  # metadata filter, see MetadataIndex
+    generate: bool = False
+    max_concurrency: int = 8
 
-    "Create a session id if not provided"
-    if session_id is None or session_id.lower() == "new":
-        session_id = memory_manager.new_session()
 
-    memory_manager.add_message(session_id, "user", query)
+def build_prompt(context: str, query: str) -> str:
+    return f"""
+    You are an intelligent assistant. Use the following context to answer the question.
+    If the context does not contain the answer, say "I'm not sure based on the provided data."
 
-    # --- Retrieval  long term memory---
-    query_emb = await asyncio.to_thread(sentence_embedder.embed, [query])
-    query_emb = query_emb[0]
-    docs : List[str]    = []
+    Context:
+    {context}
+
+    Question:
+    {query}
 
-    async with store_lock:
-        if mode == "vector":
-            docs,metadata = await asyncio.to_thread(vector_store.search, query_emb, top_k=10)
+    Answer:
+    """
+
+def retrieve_batch(mode: str, query_embs, queries: List[str], top_k: int,
+                   filter_query: Optional[Dict[str, Any]] = None) -> List[List[dict]]:
+    "Retrieve for all queries at once: one multi-row FAISS search and/or one batched BM25 pass"
+    allowed = metadata_index.bitmap(filter_query)
+    if mode == "hybrid":
+        return hybrid_retriever.search_batch(query_embs, queries, top_k=top_k, allowed=allowed)
+    if mode == "vector":
+        legs = vector_store.search_ids_batch(query_embs, top_k, allowed)
+    else:
+        legs = bm25_retriever.retrieve_ids_batch(queries, top_k=top_k, allowed=allowed)
+
+    texts, metadata = vector_store.get_chunks(np.concatenate([ids for ids, _ in legs]))
+    results, start = [], 0
+    for ids, scores in legs:
+        end = start + len(ids)
+        results.append([
+            {"id": chunk_id, "score": score, "text": text, "metadata": meta}
+            for chunk_id, score, text, meta in zip(ids.tolist(), scores.tolist(), texts[start:end], metadata[start:end])
+            if text is not None
+        ])
+        start = end
+    return results
+
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    """
+    Retrieve for many queries in one request (offline evaluation, bulk Q&A).
+    Queries are embedded in one batched call and searched together; with
+    generate=true, answers are produced with at most max_concurrency Gemini
+    calls in flight.
+    """
+    if vector_store is None or not vector_store.texts:
+        return {"error": "No vector store or documents available. Please upload a file first."}
+    if request.mode not in ("vector", "bm25", "hybrid"):
+        return {"error": "Invalid mode. Choose vector, bm25, or hybrid."}
+    if not request.queries:
+        return {"mode": request.mode, "results": []}
 
-        elif mode == "bm25":
-            docs, _ = await asyncio.to_thread(bm25_retriever.retrieve, query, top_k=10)
+    query_embs = await asyncio.to_thread(sentence_embedder.embed_array, request.queries)
+    try:
+        async with store_lock.read():
+            hits = await asyncio.to_thread(retrieve_batch, request.mode, query_embs, request.queries,
+                                           request.top_k, request.filter)
+    except ValueError as e:  # unknown filter field or operator
+        return {"error": str(e)}
+
+    answers = [None] * len(request.queries)
+    if request.generate:
+        semaphore = asyncio.Semaphore(max(1, min(request.max_concurrency, MAX_BATCH_GENERATIONS)))
+
+        async def answer(query: str, query_hits: List[dict]) -> str:
+            prompt = build_prompt("\n\n".join(hit["text"] for hit in query_hits), query)
+            async with semaphore:
+                try:
+                    completion = await asyncio.to_thread(get_gemini_client().models.generate_content,
+                        model="gemini-2.5-flash",
+                        contents=prompt,
+                        config={"temperature": 0.3}
+                    )
+                except Exception as e:
+                    # One failed generation should not fail the whole batch
+                    return f"Error processing request: {e}"
+            return completion.text.strip()
+
+        answers = await asyncio.gather(*(answer(q, h) for q, h in zip(request.queries, hits)))
 
-        elif mode == "hybrid":
-            hybrid = HybridRetriever(vector_store, bm25_retriever, alpha=0.6)
-            docs = await asyncio.to_thread(hybrid.retrieve, query_emb, query, top_k=10)
+    return {
+        "mode": request.mode,
+        "results": [
+            {
+                "query": query,
+                "answer": query_answer,
+                "ids": [hit["id"] for hit in query_hits],
+                "scores": [hit["score"] for hit in query_hits],
+                "retrieved_context": [hit["text"] for hit in query_hits],
+                "metadata": [hit["metadata"] for hit in query_hits],
+            }
+            for query, query_hits, query_answer in zip(request.queries, hits, answers)
+        ],
+    }
 
 
-        # Metadata filter
-        if filter_source:
-            mf = MetadataFilter(metadata_store)
-            docs = mf.filter(docs, {"source": filter_source})
+async def chat_context_docs(query: str, mode: str, rerank: bool, filter_source: Optional[str],
+                            llm_rerank: bool = False) -> List[str]:
+    """Retrieve, filter and rerank the knowledge-base chunks for a chat turn."""
+    query_emb = await query_batcher.submit(query)
 
-        if not docs:
-            return {"answer": "No documents match the metadata filter."}
+    # Metadata filter is applied inside the search, before top-k
+    filter_query = {"source": filter_source} if filter_source else None
+    async with store_lock.read():
+        hits = await asyncio.to_thread(retrieve_hits, query, query_emb, mode, 10, filter_query, 0.6)
+    doc_ids, docs = hits or ([], [])  # chunk ids key the reranker's score cache
 
+    if not docs:
+        return []
 
-        # Reranking
-        if docs and rerank:
-            reranked = await asyncio.to_thread(reranker.rerank, query, docs, top_k=5)
-            ranked_docs = [x[0] for x in reranked]
 
-        else:
-            ranked_docs = docs[:5]
+    # Reranking (outside the store lock; concurrent chats share cross-encoder batches)
+    if rerank:
+        return await rerank_docs(query, docs, doc_ids, llm_rerank)
+    return docs[:5]
 
+def chat_contents(session_id: str, query: str, ranked_docs: List[str]) -> List[dict]:
+    """Gemini contents for a chat turn: instructions, short-term memory and knowledge-base context."""
 # 3a. System instruction as a model message (old SDK does NOT support system_instruction param)
     system_instruction_text = (
     "You are an intelligent assistant. You must stick to the user's instructions and maintain continuity. "
@@ -481,7 +1037,7 @@ async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bo
     context = "\n\n".join(ranked_docs)
 
 # 3c. Correct content structure for OLD Gemini SDK
-    contents_payload = [
+    return [
         {
             "role": "model",
             "parts": [
@@ -498,12 +1054,35 @@ async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bo
     }
 ]
 
+@app.post("/chat/")
+async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bool=True, filter_source:str=None,
+                        llm_rerank:bool=False):
+    """
+    Chat endpoint with:
+    - Short-term memory (per session)
+    - Long-term memory (FAISS RAG)
+    - Hybrid retrieval + reranking
+    - Gemini LLM generation
+    """
+    global memory_manager, vector_store, bm25_retriever, metadata_store
+
+    "Create a session id if not provided"
+    if session_id is None or session_id.lower() == "new":
+        session_id = memory_manager.new_session()
+
+    memory_manager.add_message(session_id, "user", query)
+
+    ranked_docs = await chat_context_docs(query, mode, rerank, filter_source, llm_rerank)
+    if not ranked_docs:
+        return {"answer": "No documents match the metadata filter."}
+    contents_payload = chat_contents(session_id, query, ranked_docs)
+
 # 4. Gemini call
     answer = "An unknown error occurred."
 
     try:
         completion = await asyncio.to_thread(
-            gemini_client.models.generate_content,
+            get_gemini_client().models.generate_content,
             model="gemini-2.5-flash",
             contents=contents_payload,
             config={"temperature": 0.3},
@@ -543,7 +1122,7 @@ async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bo
 #     """
 
 #     # --- CORRECTED GEMINI API CALL ---
-#     completion = await asyncio.to_thread(gemini_client.models.generate_content,
+#     completion = await asyncio.to_thread(get_gemini_client().models.generate_content,
 #         model="gemini-2.5-flash",
 #         contents=prompt, 
 #         config={"temperature": 0.3}
@@ -563,3 +1142,122 @@ async def chat_endpoint(query:str , session_id:str, mode:str="hybrid", rerank:bo
     }                        
 
 
+# -----------------------------------------------------------
+# Streaming variants (server-sent events)
+# -----------------------------------------------------------
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_answer(context_event: dict, contents, on_complete: Optional[Callable[[str], None]] = None,
+                        cached_answer: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    SSE body: a "context" event with the retrieved chunks first, then one
+    "token" event per piece of text as Gemini produces it, then "done" with
+    the full answer (or "error"). A cached_answer is sent as a single token.
+    """
+    yield sse_event("context", context_event)
+    if cached_answer is not None:
+        yield sse_event("token", {"text": cached_answer})
+        yield sse_event("done", {"answer": cached_answer, "cached": True})
+        return
+
+    parts = []
+    try:
+        stream = await get_gemini_client().aio.models.generate_content_stream(
+            model="gemini-2.5-flash",
+            contents=contents,
+            config={"temperature": 0.3},
+        )
+        async for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield sse_event("token", {"text": chunk.text})
+    except Exception as e:
+        print("Gemini Error:", e)
+        yield sse_event("error", {"error": f"Error processing request: {e}"})
+        return
+
+    answer = "".join(parts).strip()
+    if on_complete is not None:
+        on_complete(answer)
+    yield sse_event("done", {"answer": answer, "cached": False})
+
+def stream_cached_answer(context_event: dict, prompt: str, query_emb, chunk_ids: List[int], namespace,
+                         cache_version: int) -> AsyncIterator[str]:
+    """stream_answer() backed by the semantic answer cache (same keys as generate_cached)."""
+    cached_answer = answer_cache.lookup(query_emb, chunk_ids, namespace)
+    started = time.perf_counter()
+    return stream_answer(
+        context_event,
+        prompt,
+        on_complete=lambda answer: answer_cache.store(
+            query_emb, chunk_ids, answer, namespace, time.perf_counter() - started, cache_version),
+        cached_answer=cached_answer,
+    )
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/query/stream")
+async def query_rag_stream(query: str, mode: str = "hybrid"):
+    """Streaming /query/: retrieved context first, then answer tokens as they arrive."""
+    if vector_store is None or not vector_store.texts:
+        return {"error": "No vector store or documents available. Please upload a file first."}
+
+    cache_version = answer_cache.corpus_version
+    query_emb = await query_batcher.submit(query)
+    retrieved = await retrieve_chunks(query, query_emb, mode, top_k=3)
+    if retrieved is None:
+        return {"error": "Invalid mode. Choose vector, bm25, or hybrid."}
+    chunk_ids, top_chunks = retrieved
+
+    prompt = build_prompt("\n\n".join(top_chunks), query)
+    return sse_response(stream_cached_answer(
+        {"mode": mode, "query": query, "retrieved_context": top_chunks},
+        prompt, query_emb, chunk_ids, ("query", mode), cache_version,
+    ))
+
+@app.get("/generate_gemini/stream")
+async def generate_response_stream(query: str):
+    """Streaming /generate_gemini/."""
+    if vector_store is None or not vector_store.texts:
+        return {"error": "No FAISS index found. Please upload a file first."}
+
+    cache_version = answer_cache.corpus_version
+    query_embedding = await query_batcher.submit(query)
+    chunk_ids, results = await retrieve_chunks(query, query_embedding, "vector", top_k=3)
+
+    prompt = build_prompt("\n".join(results), query)
+    return sse_response(stream_cached_answer(
+        {"query": query, "retrieved_context": results},
+        prompt, query_embedding, chunk_ids, ("generate_gemini",), cache_version,
+    ))
+
+@app.post("/chat/stream")
+async def chat_stream(query: str, session_id: str, mode: str = "hybrid", rerank: bool = True, filter_source: str = None,
+                      llm_rerank: bool = False):
+    """Streaming /chat/: the answer is added to the session memory once generation completes."""
+    if session_id is None or session_id.lower() == "new":
+        session_id = memory_manager.new_session()
+
+    memory_manager.add_message(session_id, "user", query)
+
+    ranked_docs = await chat_context_docs(query, mode, rerank, filter_source, llm_rerank)
+    if not ranked_docs:
+        return {"answer": "No documents match the metadata filter."}
+    contents_payload = chat_contents(session_id, query, ranked_docs)
+
+    context_event = {
+        "session_id": session_id,
+        "query": query,
+        "short_term_memory": memory_manager.get_short_term_memory(session_id),
+        "long_term_docs_used": ranked_docs[:3],
+        "mode": mode,
+    }
+    return sse_response(stream_answer(
+        context_event,
+        contents_payload,
+        on_complete=lambda answer: memory_manager.add_message(session_id, "assistant", answer),
+    ))
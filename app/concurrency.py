@@ -0,0 +1,102 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class AsyncRWLock:
+    """
+    Asyncio reader-writer lock: any number of readers, or one writer.
+
+    Searches take the read side and run in parallel (FAISS and numpy release
+    the GIL in their worker threads); index mutations take the write side.
+    Writers are preferred: once one is waiting, new readers queue behind it,
+    so a steady stream of queries cannot starve ingestion, and since writers
+    only hold the lock for one small batch, readers wait at most that long.
+    """
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._cond:
+            self._writers_waiting += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                # Also runs on cancellation, so a cancelled writer doesn't block readers forever
+                self._writers_waiting -= 1
+                self._cond.notify_all()
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+    def stats(self):
+        return {"readers": self._readers, "writer": self._writer, "writers_waiting": self._writers_waiting}
+
+
+class InterProcessLock:
+    """
+    Exclusive lock shared by all processes on the host: fcntl.flock on a lock
+    file. Used to let exactly one uvicorn worker write the index at a time.
+    Without fcntl (Windows) it is a no-op, which is only safe with one worker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        "Block until the lock is held"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        self._file = f
+
+    def release(self):
+        f, self._file = self._file, None
+        if f is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+    @asynccontextmanager
+    async def hold(self):
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread still gets the lock eventually; give it straight back
+            acquiring.add_done_callback(lambda _: self.release())
+            raise
+        try:
+            yield
+        finally:
+            self.release()
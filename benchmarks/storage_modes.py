@@ -0,0 +1,118 @@
+"""
+Recall / latency / memory of FaissStore storage modes against the flat
+float32 baseline.
+
+    python -m benchmarks.storage_modes                       # synthetic 384-d corpus
+    python -m benchmarks.storage_modes --vectors emb.npy     # real embeddings (n x d float32)
+
+Every mode is built, saved and loaded again, so the exact rescoring reads the
+float32 vectors from the memory-mapped segment files like a server would.
+Recall@k is measured against exact brute-force search over all vectors.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_Store.faiss_Store import STORAGE_MODES, FaissStore
+
+
+def synthetic_corpus(rows: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    "Clustered unit vectors, roughly shaped like sentence embeddings"
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.6 * rng.normal(size=(rows, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def ground_truth(corpus: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    index = faiss.IndexFlatL2(corpus.shape[1])
+    index.add(corpus)
+    return index.search(queries, top_k)[1]
+
+
+def run_mode(storage: str, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, top_k: int,
+             index_spec: str, rescore_factor: Optional[int]) -> Dict[str, float]:
+    tmp = tempfile.mkdtemp()
+    try:
+        base = os.path.join(tmp, "store")
+        store = FaissStore(dimension=corpus.shape[1], index_spec=index_spec, storage=storage,
+                           rescore_factor=rescore_factor)
+        started = time.perf_counter()
+        store.add([""] * len(corpus), corpus, [{}] * len(corpus))
+        store.save(base)
+        build_seconds = time.perf_counter() - started
+
+        store = FaissStore(dimension=corpus.shape[1])
+        store.load(base)
+        index_bytes = len(faiss.serialize_index(store.index))
+
+        store.search_ids(queries[0], top_k)  # warm up
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            ids, _ = store.search_ids(query, top_k)
+            latencies.append(time.perf_counter() - started)
+            hits += len(set(ids.tolist()) & set(expected.tolist()))
+        started = time.perf_counter()
+        store.search_ids_batch(queries, top_k)
+        batch_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "bytes/vector": index_bytes / len(corpus),
+        "recall": hits / truth.size,
+        "p50 ms": float(np.percentile(latencies, 50)),
+        "p95 ms": float(np.percentile(latencies, 95)),
+        "batch qps": len(queries) / batch_seconds,
+        "build s": build_seconds,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help=".npy file of corpus embeddings (default: synthetic)")
+    parser.add_argument("--rows", type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument("--dimension", type=int, default=384, help="synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--index-spec", default="Flat", help="index structure (binary needs Flat)")
+    parser.add_argument("--rescore-factor", type=int, help="shortlist size per hit (default per mode)")
+    parser.add_argument("--modes", nargs="+", default=list(STORAGE_MODES), choices=list(STORAGE_MODES))
+    args = parser.parse_args(argv)
+
+    if args.vectors:
+        corpus = np.ascontiguousarray(np.load(args.vectors), dtype=np.float32)
+    else:
+        corpus = synthetic_corpus(args.rows, args.dimension)
+    # Queries: corpus vectors with noise added
+    rng = np.random.default_rng(1)
+    queries = corpus[rng.choice(len(corpus), args.queries, replace=False)]
+    queries = (queries + 0.3 * rng.normal(size=queries.shape) * queries.std()).astype(np.float32)
+    truth = ground_truth(corpus, queries, args.top_k)
+    print(f"🔍 {len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, recall@{args.top_k}")
+
+    results = {}
+    for storage in args.modes:
+        if storage == "binary" and args.index_spec != "Flat":
+            print("⚠️ Skipping binary: it needs --index-spec Flat")
+            continue
+        results[storage] = run_mode(storage, corpus, queries, truth, args.top_k, args.index_spec, args.rescore_factor)
+
+    columns = ["bytes/vector", "recall", "p50 ms", "p95 ms", "batch qps", "build s"]
+    print(f"{'storage':<10}" + "".join(f"{c:>14}" for c in columns))
+    for storage, row in results.items():
+        print(f"{storage:<10}" + "".join(f"{row[c]:>14.3f}" if c == "recall" else f"{row[c]:>14.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Set
+import numpy as np
+
+_MERSENNE = (1 << 31) - 1  # keeps a * h below 2**62, so uint64 arithmetic can't overflow
+
+
+class ChunkDeduplicator:
+    def __init__(self, near_duplicates: bool = False, threshold: float = 0.9, num_perm: int = 64,
+                 bands: int = 8, shingle_size: int = 3):
+        """
+        Maps chunk text to the id of a stored chunk with the same content, so
+        repeated chunks (headers, footers, disclaimers, re-uploaded files) are
+        not embedded or indexed again but reference the stored one.
+
+        Exact duplicates are found by a hash of the whitespace-normalised text.
+        With near_duplicates, MinHash signatures over word shingles are bucketed
+        by LSH (bands of num_perm // bands rows); candidates whose estimated
+        Jaccard similarity reaches threshold count as duplicates too.
+        """
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, _MERSENNE, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE, num_perm, dtype=np.uint64)
+        self._exact: Dict[bytes, int] = {}
+        self._key_of: Dict[int, bytes] = {}
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(bands)]
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+    def _signature(self, text: str) -> Optional[np.ndarray]:
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < self.shingle_size:
+            return None  # too short for a meaningful similarity; exact matching only
+        shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        hashes %= _MERSENNE
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def __contains__(self, chunk_id) -> bool:
+        return int(chunk_id) in self._key_of
+
+    def __len__(self) -> int:
+        return len(self._key_of)
+
+    @property
+    def ids(self) -> Set[int]:
+        return set(self._key_of)
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        "Register stored chunks as the canonical copies of their content"
+        for chunk_id, text in zip(ids, texts):
+            chunk_id = int(chunk_id)
+            key = self._key(text)
+            self._exact.setdefault(key, chunk_id)
+            self._key_of[chunk_id] = key
+            if self.near_duplicates:
+                signature = self._signature(text)
+                if signature is not None:
+                    self._signatures[chunk_id] = signature
+                    for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                        bucket.setdefault(band, set()).add(chunk_id)
+
+    def remove(self, ids: Iterable[int]):
+        "Forget deleted chunks; later copies of their content are stored again"
+        for chunk_id in ids:
+            chunk_id = int(chunk_id)
+            key = self._key_of.pop(chunk_id, None)
+            if key is not None and self._exact.get(key) == chunk_id:
+                del self._exact[key]
+            signature = self._signatures.pop(chunk_id, None)
+            if signature is not None:
+                for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                    members = bucket.get(band)
+                    if members is not None:
+                        members.discard(chunk_id)
+                        if not members:
+                            del bucket[band]
+
+    def find(self, texts: List[str]) -> List[Optional[int]]:
+        "For each text, the id of a stored chunk it duplicates, or None if it is new"
+        found: List[Optional[int]] = []
+        for text in texts:
+            chunk_id = self._exact.get(self._key(text))
+            if chunk_id is not None:
+                self.exact_hits += 1
+            elif self.near_duplicates:
+                chunk_id = self._find_near(text)
+                if chunk_id is not None:
+                    self.near_hits += 1
+            found.append(chunk_id)
+        return found
+
+    def _find_near(self, text: str) -> Optional[int]:
+        signature = self._signature(text)
+        if signature is None:
+            return None
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            candidates |= bucket.get(band, set())
+        best, best_similarity = None, 0.0
+        for chunk_id in sorted(candidates):
+            similarity = float(np.mean(self._signatures[chunk_id] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best_similarity):
+                best, best_similarity = chunk_id, similarity
+        return best
+
+    def stats(self) -> Dict[str, int]:
+        return {"chunks": len(self._key_of), "exact_hits": self.exact_hits, "near_hits": self.near_hits}
@@ -2,6 +2,7 @@ import os
 import docx
 import csv
 import fitz
+from typing import Iterator, Optional
 
 
 class Loader:
@@ -25,6 +26,47 @@ class Loader:
         else:
             raise ValueError(f"Unsupported file type: {file_path}") 
 
+    def page_count(self, file_path: str) -> int:
+        "Number of pages of a PDF; other file types count as a single page"
+        if file_path.endswith('.pdf'):
+            with fitz.open(file_path) as doc:
+                return doc.page_count
+        return 1
+
+    def iter_pages(self, file_path: str, block_size: int = 64 * 1024,
+                   start_page: int = 0, stop_page: Optional[int] = None) -> Iterator[str]:
+        """
+        Yield the text of a file one page (PDF), paragraph (DOCX), row (CSV)
+        or block (TXT) at a time so callers never hold the whole document.
+        Pieces keep their trailing newline, so concatenating them gives the
+        same text as load_files. start_page/stop_page select a page range of
+        a PDF, so one large PDF can be parsed by several processes.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File {file_path} does not exist.")
+
+        if file_path.endswith('.txt'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                while True:
+                    block = f.read(block_size)
+                    if not block:
+                        break
+                    yield block
+        elif file_path.endswith('.csv'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    yield ' '.join(row) + '\n'
+        elif file_path.endswith('.pdf'):
+            with fitz.open(file_path) as doc:
+                for page in doc.pages(start_page, stop_page):
+                    yield page.get_text("text") + '\n'
+        elif file_path.endswith('.docx'):
+            document = docx.Document(file_path)
+            for paragraph in document.paragraphs:
+                yield paragraph.text + '\n'
+        else:
+            raise ValueError(f"Unsupported file type: {file_path}")
+
 
     def _load_txt(self, file_path: str) -> str:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -39,10 +81,8 @@ class Loader:
             return text.strip()
 
     def _load_pdf(self, file_path: str) -> str:
-        text = ""
         with fitz.open(file_path) as doc:
-            for page in doc:
-                text += page.get_text("text") + '\n'
+            text = '\n'.join(page.get_text("text") for page in doc)
         return text.strip()
 
     def _load_docx(self, file_path: str) -> str:
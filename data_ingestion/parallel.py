@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Iterator, List, Optional, Tuple, Union
+from .loader import Loader
+
+_worker_loader: Optional[Loader] = None
+
+
+def _parse_range(file_path: str, start_page: int, stop_page: Optional[int]) -> str:
+    "Runs in a worker process: the text of one page range (the whole file for non-PDFs)"
+    global _worker_loader
+    if _worker_loader is None:
+        _worker_loader = Loader()
+    return "".join(_worker_loader.iter_pages(file_path, start_page=start_page, stop_page=stop_page))
+
+
+class ParallelParser:
+    def __init__(self, loader: Loader, max_workers: Optional[int] = None, pages_per_task: int = 32,
+                 max_pending_tasks: Optional[int] = None):
+        """
+        Parses many files in a process pool, so PDF/DOCX/CSV extraction uses
+        every core instead of one GIL-bound thread. PDFs are split into page
+        ranges of pages_per_task pages, so a single large PDF fans out too.
+
+        Args:
+            loader: Used in this process to count PDF pages when planning tasks.
+            max_workers: Worker processes (default: CPU count).
+            pages_per_task: PDF pages per task.
+            max_pending_tasks: Tasks submitted ahead of the consumer; bounds the
+                        parsed text held in memory (default: 4 per worker).
+        """
+        self.loader = loader
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.max_pending_tasks = max_pending_tasks or 4 * self.max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that already runs model/server threads is unsafe
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _ranges(self, file_path: str) -> List[Tuple[int, Optional[int]]]:
+        if not file_path.endswith('.pdf'):
+            return [(0, None)]
+        pages = self.loader.page_count(file_path)
+        return [(start, min(start + self.pages_per_task, pages)) for start in range(0, max(pages, 1), self.pages_per_task)]
+
+    def iter_documents(self, file_paths: List[str]) -> Iterator[Tuple[str, Union[List[str], Exception]]]:
+        """
+        Yield (file_path, text pieces in page order) for each file, in input
+        order, while the following files are parsed in the background. A file
+        that fails to parse yields its exception instead of pieces.
+        """
+        remaining = iter(file_paths)
+        queue: Deque[Tuple[str, Union[List[Future], Exception]]] = deque()
+        pending = 0
+
+        def fill():
+            nonlocal pending
+            while pending < self.max_pending_tasks:
+                file_path = next(remaining, None)
+                if file_path is None:
+                    return
+                try:
+                    futures = [self.pool.submit(_parse_range, file_path, start, stop)
+                               for start, stop in self._ranges(file_path)]
+                except Exception as e:
+                    queue.append((file_path, e))
+                    continue
+                queue.append((file_path, futures))
+                pending += len(futures)
+
+        fill()
+        while queue:
+            file_path, futures = queue.popleft()
+            if isinstance(futures, Exception):
+                yield file_path, futures
+                continue
+            try:
+                pieces = [future.result() for future in futures]
+            except Exception as e:
+                pieces = e
+                if isinstance(e, BrokenProcessPool):
+                    self._pool = None  # a worker died (e.g. out of memory); later files get a fresh pool
+            pending -= len(futures)
+            fill()
+            yield file_path, pieces
@@ -0,0 +1,62 @@
+from typing import Any, Iterator, List, Tuple
+from .dedup import ChunkDeduplicator
+from .loader import Loader
+from .preprocessor import TextPreprocessor
+
+
+class IngestionPipeline:
+    """
+    Generator pipeline: page -> cleaned text -> chunks -> embedding batches.
+
+    Only one page and one batch of chunks are alive at a time, so peak memory
+    stays flat regardless of document size and every batch can be added to
+    the stores as soon as it is embedded.
+    """
+
+    def __init__(self, loader: Loader, preprocessor: TextPreprocessor, embedder, batch_size: int = 64):
+        self.loader = loader
+        self.preprocessor = preprocessor
+        self.embedder = embedder
+        self.batch_size = batch_size
+
+    def iter_chunks(self, file_path: str) -> Iterator[str]:
+        "Stream the chunks of a file without loading it fully"
+        return self.preprocessor.chunk_stream(self.loader.iter_pages(file_path))
+
+    def iter_batches(self, file_path: str) -> Iterator[Tuple[List[str], Any]]:
+        "Yield (chunks, embeddings) batches of at most batch_size chunks"
+        batch = []
+        for chunk in self.iter_chunks(file_path):
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                yield batch, self.embedder.embed_array(batch)
+                batch = []
+        if batch:
+            yield batch, self.embedder.embed_array(batch)
+
+    def iter_unique_batches(self, file_path: str, deduplicator: ChunkDeduplicator) -> Iterator[Tuple[List[str], Any, List[int]]]:
+        """
+        Like iter_batches, but chunks the deduplicator already knows (or that
+        repeat within the batch) are not embedded. Yields (new chunks, their
+        embeddings, ids of the stored chunks the skipped ones duplicate).
+        Register each batch with the deduplicator before pulling the next one
+        so repeats across batches are caught as well.
+        """
+        batch: List[str] = []
+        for chunk in self.iter_chunks(file_path):
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                yield self._unique(batch, deduplicator)
+                batch = []
+        if batch:
+            yield self._unique(batch, deduplicator)
+
+    def _unique(self, batch: List[str], deduplicator: ChunkDeduplicator) -> Tuple[List[str], Any, List[int]]:
+        new, duplicates, seen = [], [], set()
+        for chunk, existing in zip(batch, deduplicator.find(batch)):
+            if existing is not None:
+                duplicates.append(existing)
+            elif chunk not in seen:
+                seen.add(chunk)
+                new.append(chunk)
+        return new, self.embedder.embed_array(new), duplicates
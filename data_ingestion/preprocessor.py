@@ -1,5 +1,5 @@
 import re
-from typing import List
+from typing import Iterable, Iterator, List
 
 
 class TextPreprocessor:
@@ -24,3 +24,27 @@ class TextPreprocessor:
             chunks.append(chunk)
             start += self.chunk_size - self.overlap  # Move start forward by chunk size minus overlap
         return chunks
+
+    def chunk_stream(self, pieces: Iterable[str]) -> Iterator[str]:
+        """
+        Streaming version of chunk_text over consecutive pieces of one document.
+        Yields exactly the chunks chunk_text would produce for "".join(pieces),
+        but only keeps about one chunk of cleaned text buffered at a time.
+        """
+        step = self.chunk_size - self.overlap
+        buffer = ""
+        for piece in pieces:
+            cleaned = re.sub(r'\s+', ' ', piece)
+            if not buffer:
+                cleaned = cleaned.lstrip()
+            elif buffer.endswith(' ') and cleaned.startswith(' '):
+                cleaned = cleaned[1:]
+            buffer += cleaned
+            # A chunk is final once at least one character follows it
+            while len(buffer) > self.chunk_size:
+                yield buffer[:self.chunk_size]
+                buffer = buffer[step:]
+        buffer = buffer.rstrip()
+        while buffer:
+            yield buffer[:self.chunk_size]
+            buffer = buffer[step:]
@@ -1,7 +1,14 @@
 from abc import ABC, abstractmethod
 from typing import List
+import numpy as np
 
 class baseEmbedding(ABC):
     @abstractmethod
     def embed(self, texts: List[str]) -> List[List[float]]:
-        pass
\ No newline at end of file
+        pass
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        "Embed texts into a contiguous (n, dim) float32 array"
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(self.embed(texts), dtype=np.float32)
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .base_embedder import baseEmbedding
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, only safe with one worker
+    fcntl = None
+
+
+class _DiskCache:
+    """
+    Append-only on-disk tier: float32 rows in fixed-size shard files that are
+    memory-mapped for reads, plus an index log of "key shard row" lines.
+    Eviction drops whole shards, oldest first.
+
+    Several processes (uvicorn workers) may share one directory: every write
+    holds an flock on <dir>/lock, takes the next row from the real shard file
+    size and first reads the index lines other processes appended, so rows
+    never interleave and no entry points at another text's vector.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int, shard_size: int):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.shard_size = shard_size
+        self.entries: Dict[str, Tuple[int, int]] = {}
+        self.shard_rows: Dict[int, int] = {}
+        self.dimension = None
+        self._maps: Dict[int, np.memmap] = {}
+        self._log_inode = None  # index.log is replaced (new inode) when any process evicts
+        self._log_offset = 0  # bytes of index.log already read
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._locked():
+            self._sync()
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.cache_dir, f"shard_{shard:06d}.f32")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, "index.log")
+
+    @contextmanager
+    def _locked(self):
+        "Exclusive flock shared with the other processes using this directory"
+        with open(os.path.join(self.cache_dir, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _shard_size_rows(self, shard: int) -> int:
+        path = self._shard_path(shard)
+        return os.path.getsize(path) // (self.dimension * 4) if os.path.exists(path) else 0
+
+    def _sync(self):
+        "Catch up with index lines written by other processes; call with the lock held"
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        if self.dimension is None and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dimension = json.load(f)["dimension"]
+        if self.dimension is None or not os.path.exists(self._index_path()):
+            return
+
+        stat = os.stat(self._index_path())
+        if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+            # Rewritten by an eviction (possibly in another process): start over
+            self.entries, self.shard_rows, self._maps = {}, {}, {}
+            self._log_inode, self._log_offset = stat.st_ino, 0
+        if stat.st_size == self._log_offset:
+            return
+        with open(self._index_path(), "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]  # a torn last line is re-read once complete
+        self._log_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) != 3:
+                continue  # torn write from a crash
+            key, shard, row = parts[0], int(parts[1]), int(parts[2])
+            if shard not in self.shard_rows or row >= self.shard_rows[shard]:
+                self.shard_rows[shard] = self._shard_size_rows(shard)
+            if row < self.shard_rows[shard]:
+                self.entries[key] = (shard, row)
+
+    def refresh(self):
+        "Pick up entries other processes added since the last look (cheap when there are none)"
+        try:
+            stat = os.stat(self._index_path())
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._log_inode or stat.st_size != self._log_offset:
+            with self._locked():
+                self._sync()
+
+    def _init_dimension(self, dimension: int):
+        self.dimension = dimension
+        with open(os.path.join(self.cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dimension": dimension}, f)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        location = self.entries.get(key)
+        if location is None:
+            return None
+        shard, row = location
+        mapped = self._maps.get(shard)
+        try:
+            if mapped is None or row >= mapped.shape[0]:
+                mapped = np.memmap(self._shard_path(shard), dtype=np.float32, mode="r",
+                                   shape=(self.shard_rows[shard], self.dimension))
+                self._maps[shard] = mapped
+        except (OSError, ValueError):
+            # The shard was evicted by another process since we last synced
+            self.entries.pop(key, None)
+            return None
+        return np.array(mapped[row])
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        with self._locked():
+            self._sync()
+            if self.dimension is None:
+                self._init_dimension(vectors.shape[1])
+            row_bytes = self.dimension * 4
+
+            lines = []
+            i = 0
+            # Shard numbers only grow (eviction keeps the newest), so the highest file is the open one
+            shards = [int(name[6:12]) for name in os.listdir(self.cache_dir)
+                      if name.startswith("shard_") and name.endswith(".f32")]
+            shard = max(shards) if shards else 0
+            while i < len(keys):
+                size = os.path.getsize(self._shard_path(shard)) if os.path.exists(self._shard_path(shard)) else 0
+                if size % row_bytes:
+                    # Torn append from a crashed writer: drop the partial row
+                    os.truncate(self._shard_path(shard), size - size % row_bytes)
+                row = size // row_bytes
+                if row >= self.shard_size:
+                    shard += 1
+                    continue
+                take = min(self.shard_size - row, len(keys) - i)
+                with open(self._shard_path(shard), "ab") as f:
+                    f.write(vectors[i:i + take].tobytes())
+                for j in range(take):
+                    self.entries[keys[i + j]] = (shard, row + j)
+                    lines.append(f"{keys[i + j]} {shard} {row + j}\n")
+                self.shard_rows[shard] = row + take
+                i += take
+
+            # Vectors are written before their index lines, so a crash never
+            # leaves an index entry pointing at missing data
+            with open(self._index_path(), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+            stat = os.stat(self._index_path())
+            if self._log_inode is None:
+                self._log_inode = stat.st_ino
+            self._log_offset = stat.st_size  # our own lines, already applied
+            self._evict()
+
+    def _evict(self):
+        evicted = False
+        while len(self.entries) > self.max_entries and len(self.shard_rows) > 1:
+            oldest = min(self.shard_rows)
+            del self.shard_rows[oldest]
+            self._maps.pop(oldest, None)
+            self.entries = {k: loc for k, loc in self.entries.items() if loc[0] != oldest}
+            os.remove(self._shard_path(oldest))
+            evicted = True
+        if not evicted:
+            return
+
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{k} {shard} {row}\n" for k, (shard, row) in self.entries.items())
+        os.replace(tmp_path, self._index_path())
+        stat = os.stat(self._index_path())
+        self._log_inode, self._log_offset = stat.st_ino, stat.st_size
+
+
+class CachedEmbedder(baseEmbedding):
+    """
+    Caching decorator for any baseEmbedding.
+
+    Embeddings are keyed by (model name, text hash) and looked up in an
+    in-memory LRU first, then in an optional memory-mapped disk tier.
+    Only texts missing from both tiers are sent to the wrapped embedder.
+    """
+
+    def __init__(self, embedder: baseEmbedding, cache_dir: Optional[str] = None,
+                 max_memory_entries: int = 10000, max_disk_entries: int = 1000000,
+                 shard_size: int = 4096):
+        self.embedder = embedder
+        self.model_name = getattr(embedder, "model_name", type(embedder).__name__)
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if cache_dir:
+            model_dir = re.sub(r'[^\w.-]+', '_', self.model_name)
+            self._disk = _DiskCache(os.path.join(cache_dir, model_dir), max_disk_entries, shard_size)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # Expose the wrapped embedder's attributes (dimension, model, ...)
+        if name == "embedder":
+            raise AttributeError(name)
+        return getattr(self.embedder, name)
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        keys = [self._key(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            if self._disk is not None:
+                self._disk.refresh()
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                elif self._disk is not None and (vector := self._disk.get(key)) is not None:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+                    self.misses += 1
+                    continue
+                vectors[i] = vector
+
+        if missing:
+            # Duplicate texts within one call are embedded once
+            miss_keys = list(missing)
+            computed = np.ascontiguousarray(
+                self.embedder.embed_array([texts[missing[k][0]] for k in miss_keys]), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(miss_keys, computed):
+                    vector = vector.copy()  # don't pin the whole batch array in the LRU
+                    self._remember(key, vector)
+                    for i in missing[key]:
+                        vectors[i] = vector
+                if self._disk is not None:
+                    self._disk.put_many(miss_keys, computed)
+
+        if not texts:
+            return np.empty((0, getattr(self.embedder, "dimension", 0)), dtype=np.float32)
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def stats(self) -> Dict[str, int]:
+        "Hit/miss counters and current tier sizes"
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "memory_hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk.entries) if self._disk is not None else 0,
+        }
@@ -1,10 +1,67 @@
-from sentence_transformers import SentenceTransformer
-from typing import List
+import threading
+from typing import List, Optional
+import numpy as np
 from .base_embedder import baseEmbedding
 
 class SentenceTransformerEmbedder(baseEmbedding):
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', batch_size: int = 64, normalize: bool = False):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self._model = None  # loaded on first use (or by load()), not at construction
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        "Load the model now; importing sentence-transformers/torch is most of the cost"
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        return self.load()
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def warmup(self):
+        "One small encode so the first real request doesn't pay for buffer allocation"
+        self.embed_array(["warmup"])
 
     def embed(self, texts: List[str]) -> List[List[float]]:
-        return self.model.encode(texts).tolist()
\ No newline at end of file
+        return self.model.encode(texts).tolist()
+
+    def embed_array(self, texts: List[str], batch_size: Optional[int] = None, normalize: Optional[bool] = None) -> np.ndarray:
+        """
+        Batched embedding straight into one preallocated float32 array.
+
+        Texts are encoded longest-first so every batch pads to similar lengths,
+        and results are written back in input order without a list round-trip.
+        """
+        batch_size = batch_size or self.batch_size
+        normalize = self.normalize if normalize is None else normalize
+
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            embeddings[batch_idx] = self.model.encode(
+                [texts[i] for i in batch_idx],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+
+        if normalize and len(texts):
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            np.maximum(norms, 1e-12, out=norms)
+            embeddings /= norms
+        return embeddings
@@ -0,0 +1,125 @@
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+
+
+class _Postings:
+    "Chunk ids carrying one field value, appended in batches and concatenated on demand"
+
+    def __init__(self):
+        self._parts: List[np.ndarray] = []
+        self._array: Optional[np.ndarray] = None
+
+    def extend(self, ids: np.ndarray):
+        self._parts.append(ids)
+        self._array = None
+
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.concatenate(self._parts) if self._parts else np.empty(0, dtype=np.int64)
+            self._parts = [self._array]
+        return self._array
+
+
+class MetadataIndex:
+    def __init__(self, exact_fields: Sequence[str] = ("source",),
+                 range_fields: Sequence[str] = ("chunk_index", "timestamp")):
+        """
+        Inverted index over chunk metadata, keyed by stable chunk id.
+
+        Exact fields (e.g. source) map each value to the chunk ids carrying it;
+        range fields (e.g. chunk_index, timestamp) keep one numeric column
+        indexed by chunk id. A filter evaluates to a boolean bitmap over chunk
+        ids, which FaissStore.search_ids and BM25Retriever.retrieve_ids take as
+        `allowed`, so top-k is computed over matching chunks only.
+
+        Filter syntax (all conditions must hold):
+            {"source": "manual.pdf"}                   exact match
+            {"source": ["a.pdf", "b.pdf"]}             any of
+            {"chunk_index": {"gte": 0, "lt": 10}}      range (gt, gte, lt, lte)
+        """
+        self.exact_fields = tuple(exact_fields)
+        self.range_fields = tuple(range_fields)
+        self._postings: Dict[str, Dict[Any, _Postings]] = {field: {} for field in self.exact_fields}
+        self._columns: Dict[str, np.ndarray] = {field: np.empty(0, dtype=np.float64) for field in self.range_fields}
+        self._indexed = np.zeros(0, dtype=np.bool_)
+        self.size = 0  # bitmap length: highest indexed chunk id + 1
+
+    def __contains__(self, chunk_id) -> bool:
+        chunk_id = int(chunk_id)
+        return 0 <= chunk_id < self.size and bool(self._indexed[chunk_id])
+
+    def _grow(self, size: int):
+        if size <= len(self._indexed):
+            self.size = max(self.size, size)
+            return
+        capacity = max(size, 2 * len(self._indexed), 1024)
+        indexed = np.zeros(capacity, dtype=np.bool_)
+        indexed[:len(self._indexed)] = self._indexed
+        self._indexed = indexed
+        for field, column in self._columns.items():
+            grown = np.full(capacity, np.nan, dtype=np.float64)
+            grown[:len(column)] = column
+            self._columns[field] = grown
+        self.size = size
+
+    def add(self, ids: Iterable[int], metadata: Sequence[Dict[str, Any]]):
+        "Index the metadata of newly added chunks"
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        self._grow(int(ids.max()) + 1)
+        self._indexed[ids] = True
+
+        for field in self.exact_fields:
+            groups: Dict[Any, List[int]] = {}
+            for chunk_id, meta in zip(ids.tolist(), metadata):
+                value = meta.get(field) if meta else None
+                if value is not None:
+                    groups.setdefault(value, []).append(chunk_id)
+            for value, group in groups.items():
+                self._postings[field].setdefault(value, _Postings()).extend(np.asarray(group, dtype=np.int64))
+
+        for field in self.range_fields:
+            values = [meta.get(field) if meta else None for meta in metadata]
+            self._columns[field][ids] = [math.nan if v is None else float(v) for v in values]
+
+    def values(self, field: str) -> List[Any]:
+        "Distinct values of an exact field"
+        return list(self._postings[field])
+
+    def bitmap(self, filter_query: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        "Bitmap over chunk ids of the chunks matching every condition, or None for no filter"
+        if not filter_query:
+            return None
+        allowed = self._indexed[:self.size].copy()
+        for field, condition in filter_query.items():
+            if field in self._postings:
+                wanted = condition if isinstance(condition, (list, tuple, set)) else [condition]
+                match = np.zeros(self.size, dtype=np.bool_)
+                for value in wanted:
+                    postings = self._postings[field].get(value)
+                    if postings is not None:
+                        match[postings.array()] = True
+                allowed &= match
+            elif field in self._columns:
+                column = self._columns[field][:self.size]
+                if not isinstance(condition, dict):
+                    condition = {"gte": condition, "lte": condition}
+                unknown = set(condition) - set(RANGE_OPS)
+                if unknown:
+                    raise ValueError(f"Unknown range operators for {field!r}: {sorted(unknown)}")
+                with np.errstate(invalid="ignore"):  # NaN (missing) never matches
+                    if "gt" in condition:
+                        allowed &= column > condition["gt"]
+                    if "gte" in condition:
+                        allowed &= column >= condition["gte"]
+                    if "lt" in condition:
+                        allowed &= column < condition["lt"]
+                    if "lte" in condition:
+                        allowed &= column <= condition["lte"]
+            else:
+                raise ValueError(f"Metadata field {field!r} is not indexed")
+        return allowed
@@ -1,4 +1,13 @@
+import os
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("app.api:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    host = os.getenv("HOST", "127.0.0.1")
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("RAG_WORKERS", "1"))
+    if workers > 1:
+        # Worker processes map the same index files, so their pages are shared
+        # through the OS cache; writes are coordinated in app/api.py
+        uvicorn.run("app.api:app", host=host, port=port, workers=workers)
+    else:
+        uvicorn.run("app.api:app", host=host, port=port, reload=True)
@@ -0,0 +1,121 @@
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+class _Entry:
+    __slots__ = ("bucket", "embedding", "answer", "version", "created", "latency")
+
+    def __init__(self, bucket, embedding, answer, version, created, latency):
+        self.bucket = bucket
+        self.embedding = embedding
+        self.answer = answer
+        self.version = version
+        self.created = created
+        self.latency = latency
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers for near-identical questions.
+
+    An entry is reused when the new query retrieved exactly the same chunk
+    ids (in the same order, for the same endpoint/mode) against the same
+    corpus version, and its embedding has cosine similarity >= threshold with
+    the cached query. Since the prompt is built from those chunks, a hit
+    means the LLM would have seen the same context for a paraphrase of the
+    same question.
+
+    Entries expire after ttl_seconds, the least recently used are evicted
+    beyond max_entries, and invalidate() drops everything when the corpus
+    changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600.0, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.corpus_version = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[Hashable, Tuple[int, ...]], List[int]] = {}
+        self._next_key = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def _normalise(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    @staticmethod
+    def _bucket(namespace: Hashable, chunk_ids: Sequence[int]):
+        return namespace, tuple(int(i) for i in chunk_ids)
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        bucket = self._buckets.get(entry.bucket)
+        if bucket is not None:
+            bucket.remove(key)
+            if not bucket:
+                del self._buckets[entry.bucket]
+
+    def lookup(self, query_embedding, chunk_ids: Sequence[int], namespace: Hashable = None) -> Optional[str]:
+        "Cached answer for a similar query over the same retrieved chunks, or None"
+        now = time.monotonic()
+        best_key, best_similarity = None, self.threshold
+        query = self._normalise(query_embedding)
+        for key in list(self._buckets.get(self._bucket(namespace, chunk_ids), ())):
+            entry = self._entries[key]
+            if entry.version != self.corpus_version or now - entry.created > self.ttl_seconds:
+                self._remove(key)
+                continue
+            similarity = float(query @ entry.embedding)
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best_key)
+        entry = self._entries[best_key]
+        self.hits += 1
+        self.saved_seconds += entry.latency
+        return entry.answer
+
+    def store(self, query_embedding, chunk_ids: Sequence[int], answer: str,
+              namespace: Hashable = None, latency: float = 0.0, version: Optional[int] = None):
+        """
+        Remember an answer; latency is the generation time a later hit saves.
+        version is the corpus_version read before retrieval: if the corpus
+        changed while the answer was generated, it is not cached.
+        """
+        if version is not None and version != self.corpus_version:
+            return
+        key = next(self._next_key)
+        bucket = self._bucket(namespace, chunk_ids)
+        self._entries[key] = _Entry(bucket, self._normalise(query_embedding), answer,
+                                    self.corpus_version, time.monotonic(), latency)
+        self._buckets.setdefault(bucket, []).append(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self):
+        "The corpus changed: no cached answer may be served again"
+        self.corpus_version += 1
+        self._entries.clear()
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": len(self._entries),
+            "corpus_version": self.corpus_version,
+            "threshold": self.threshold,
+        }
@@ -1,25 +1,69 @@
+import os
+import sqlite3
+import threading
+import time
 import uuid
 from collections import defaultdict , deque
+from typing import Optional
 
 
 class MemoryManager:
-    def __init__(self, short_term_limit=5):
+    def __init__(self, short_term_limit=5, db_path: Optional[str] = None):
+        """
+        Recent chat turns per session. By default they live in this process;
+        with db_path they go to SQLite instead, so every uvicorn worker sees
+        the same sessions.
+        """
+        self.short_term_limit = short_term_limit
         self.short_term_memory = defaultdict(
             lambda: deque(maxlen=short_term_limit)
         )  # Stores recent interactions
         # Stores all interactions by session_id
-        pass
+        self.db_path = db_path
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+            self._db.commit()
 
     def new_session(self):
         session_id = str(uuid.uuid4())
-        # Init empty deque for session
-        self.short_term_memory[session_id] = deque(maxlen=5)
+        if self._db is None:
+            # Init empty deque for session
+            self.short_term_memory[session_id] = deque(maxlen=5)
         return session_id
     
     def add_message(self, session_id: str, role: str, content: str):
-        message = {"role": role, "content": content}
-        self.short_term_memory[session_id].append(message)
+        if self._db is None:
+            message = {"role": role, "content": content}
+            self.short_term_memory[session_id].append(message)
+            return
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO messages (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, time.time()),
+            )
+            # Only the last short_term_limit turns are ever read back
+            self._db.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.short_term_limit),
+            )
 
     def get_short_term_memory(self, session_id: str):
-        return list(self.short_term_memory[session_id])
-       
\ No newline at end of file
+        if self._db is None:
+            return list(self.short_term_memory[session_id])
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, self.short_term_limit),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
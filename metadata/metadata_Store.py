@@ -1,67 +1,226 @@
 import json
 import os
-from typing import List, Dict,Any
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Optional
 import uuid
 from datetime import datetime
 
+COLUMNS = ("filename", "num_chunks", "path", "start_idx", "end_idx", "timestamp", "content_hash")
+
+
 class MetadataStore:
-    def __init__(self, file_path: str = "vectore_store/metadata.json"):
-        self.file_path = file_path
-        self.data = self.load()
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        self.load()
+    def __init__(self, file_path: str = "vectore_store/metadata.db",
+                 json_path: Optional[str] = "vectore_store/metadata.json"):
+        """
+        Document metadata in SQLite (WAL mode): every change is a small
+        transaction instead of a rewrite of the whole store, readers in other
+        worker processes see commits immediately, and lookups by id, filename
+        or chunk id use indexes.
 
+        Args:
+            file_path: SQLite database file.
+            json_path: Metadata file of the previous JSON store, imported once
+                       when the database is first created.
+        """
+        self.file_path = file_path
+        self.json_path = json_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._batch_depth = 0
 
+    # -----------------------------------------------------------
+    # Connection
+    # -----------------------------------------------------------
     def load(self):
-        "Load metadata from the JSON file"
-        if os.path.exists(self.file_path):
+        "Open the database (created on first use), importing the old JSON file if it is new"
+        with self._lock:
+            if self._db is not None:
+                return self._db
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+            db = sqlite3.connect(self.file_path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS documents ("
+                    "doc_id TEXT PRIMARY KEY, filename TEXT NOT NULL, num_chunks INTEGER NOT NULL, "
+                    "path TEXT, start_idx INTEGER NOT NULL, end_idx INTEGER NOT NULL, timestamp TEXT)"
+                )
+                if "content_hash" not in {row[1] for row in db.execute("PRAGMA table_info(documents)")}:
+                    db.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+                db.execute("CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename)")
+                db.execute("CREATE INDEX IF NOT EXISTS documents_chunks ON documents (start_idx, end_idx)")
+                db.execute("CREATE INDEX IF NOT EXISTS documents_hash ON documents (content_hash)")
+                # Deduplicated chunks: stored once, referenced by every other document containing them
+                db.execute("CREATE TABLE IF NOT EXISTS chunk_refs (doc_id TEXT NOT NULL, chunk_id INTEGER NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS chunk_refs_doc ON chunk_refs (doc_id)")
+                db.execute("CREATE INDEX IF NOT EXISTS chunk_refs_chunk ON chunk_refs (chunk_id)")
+                db.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT)")
+            self._db = db
+            self._import_json()
+            return db
+
+    def _import_json(self):
+        if not self.json_path or not os.path.exists(self.json_path):
+            return
+        if self._db.execute("SELECT 1 FROM store_info WHERE key = 'json_imported'").fetchone():
+            return
+        try:
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+        except json.JSONDecodeError:
+            print("⚠️ Warning: Metadata file is corrupted. Starting with an empty store.")
+            data = {}
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO documents (doc_id, " + ", ".join(COLUMNS) + ") "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(doc_id, *(info.get(c) for c in COLUMNS)) for doc_id, info in data.items()],
+            )
+            self._db.execute("INSERT OR REPLACE INTO store_info VALUES ('json_imported', ?)", (self.json_path,))
+        print(f"✅ Imported {len(data)} documents from {self.json_path}.")
+
+    def _commit(self):
+        if self._batch_depth == 0:
+            self._db.commit()
+
+    @contextmanager
+    def batch(self):
+        "Group several changes into one transaction (one fsync instead of one per change)"
+        with self._lock:
+            self.load()
+            self._batch_depth += 1
             try:
-                with open(self.file_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("⚠️ Warning: Metadata file is corrupted. Starting with an empty store.")
-                self.data = {}
-
-        else:
-            print("ℹ️ No existing metadata file found. Starting with an empty store.")
-            self.data = {}
-
-    def save(self):
-        "Save metadata to the JSON file"
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, indent=4)
-
-    def add_document(self, filename: str, num_chunks: int, path: str, start_idx: int, end_idx: int) -> str:  
-        "Add a new document's metadata and return its unique ID"
+                yield self
+            except Exception:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._db.rollback()
+                raise
+            self._batch_depth -= 1
+            self._commit()
+
+    @staticmethod
+    def _row(row) -> Dict[str, Any]:
+        return dict(zip(COLUMNS, row))
+
+    # -----------------------------------------------------------
+    # Documents
+    # -----------------------------------------------------------
+    def add_document(self, filename: str, num_chunks: int, path: str, start_idx: int, end_idx: int,
+                     content_hash: Optional[str] = None, shared_chunk_ids: Iterable[int] = ()) -> str:
+        """
+        Add a new document's metadata and return its unique ID.
+        start_idx/end_idx is the range of chunks stored for it; shared_chunk_ids
+        are chunks it contains that were already stored for another document.
+        """
         doc_id = str(uuid.uuid4())
-        self.data[doc_id] = {
-            "filename": filename,
-            "num_chunks": num_chunks,
-            "path": path,
-            "start_idx": start_idx,
-            "end_idx": end_idx,
-            "timestamp": datetime.now().isoformat()
-        }
-        self.save()
+        with self._lock:
+            db = self.load()
+            db.execute(
+                "INSERT INTO documents (doc_id, " + ", ".join(COLUMNS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, filename, num_chunks, path, start_idx, end_idx, datetime.now().isoformat(), content_hash),
+            )
+            shared = sorted({int(i) for i in shared_chunk_ids if not start_idx <= int(i) < end_idx})
+            db.executemany("INSERT INTO chunk_refs (doc_id, chunk_id) VALUES (?, ?)", [(doc_id, i) for i in shared])
+            self._commit()
         return doc_id
-    
-    def list_documents(self) -> List[Dict[str, Any]]:
-        "List all documents in the metadata store"
-        return [{"id": doc_id, **info} for doc_id, info in self.data.items()]  
+
+    def find_by_hash(self, content_hash: str) -> Dict[str, Any]:
+        "A document with exactly this file content ({} if none)"
+        with self._lock:
+            row = self.load().execute(
+                "SELECT doc_id, " + ", ".join(COLUMNS) + " FROM documents WHERE content_hash = ? LIMIT 1",
+                (content_hash,),
+            ).fetchone()
+        return {"id": row[0], **self._row(row[1:])} if row else {}
+
+    def shared_chunks(self, doc_id: str) -> List[int]:
+        "Chunks of the document that are stored under another document's range"
+        with self._lock:
+            rows = self.load().execute("SELECT chunk_id FROM chunk_refs WHERE doc_id = ?", (doc_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def chunks_in_use(self, chunk_ids: Iterable[int], exclude_doc_id: str) -> set:
+        "The chunk ids that a document other than exclude_doc_id owns or references"
+        chunk_ids = [int(i) for i in chunk_ids]
+        with self._lock:
+            db = self.load()
+            in_use = set()
+            for start in range(0, len(chunk_ids), 500):  # stay under SQLite's bound-parameter limit
+                part = chunk_ids[start:start + 500]
+                in_use.update(row[0] for row in db.execute(
+                    "SELECT DISTINCT chunk_id FROM chunk_refs WHERE doc_id != ? AND chunk_id IN (%s)"
+                    % ",".join("?" * len(part)), (exclude_doc_id, *part)))
+            own = self.get_document(exclude_doc_id)
+            others = [i for i in chunk_ids if not (own and own["start_idx"] <= i < own["end_idx"])]
+            for chunk_id, doc in zip(others, self.documents_for_chunks(others)):
+                if doc and doc["id"] != exclude_doc_id:
+                    in_use.add(chunk_id)
+        return in_use
+
+    def list_documents(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        "List documents in the metadata store, oldest chunk range first"
+        with self._lock:
+            rows = self.load().execute(
+                "SELECT doc_id, " + ", ".join(COLUMNS) + " FROM documents ORDER BY start_idx LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [{"id": row[0], **self._row(row[1:])} for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.load().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
 
     def delete_document(self, doc_id: str):
         "Delete a document's metadata by its ID"
-        if doc_id in self.data:
-            del self.data[doc_id]
-            self.save()
+        with self._lock:
+            db = self.load()
+            db.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            db.execute("DELETE FROM chunk_refs WHERE doc_id = ?", (doc_id,))
+            self._commit()
 
     def get_document(self, doc_id: str) -> Dict[str, Any]:
         "Retrieve a document's metadata by its ID"
-        return self.data.get(doc_id, {})
-
+        with self._lock:
+            row = self.load().execute(
+                "SELECT " + ", ".join(COLUMNS) + " FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return self._row(row) if row else {}
 
-             
-    
+    def find_by_filename(self, filename: str) -> List[Dict[str, Any]]:
+        "All documents uploaded under this filename"
+        with self._lock:
+            rows = self.load().execute(
+                "SELECT doc_id, " + ", ".join(COLUMNS) + " FROM documents WHERE filename = ? ORDER BY start_idx",
+                (filename,),
+            ).fetchall()
+        return [{"id": row[0], **self._row(row[1:])} for row in rows]
 
+    def document_for_chunk(self, chunk_id: int) -> Dict[str, Any]:
+        "The document whose chunk range contains chunk_id ({} if none)"
+        return self.documents_for_chunks([chunk_id])[0]
 
-    
\ No newline at end of file
+    def documents_for_chunks(self, chunk_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """
+        Documents owning each chunk id (same order, {} for unknown ids). Chunk
+        ranges don't overlap, so each lookup is one descent of the start_idx index.
+        """
+        results = []
+        cache: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            db = self.load()
+            for chunk_id in chunk_ids:
+                chunk_id = int(chunk_id)
+                if chunk_id not in cache:
+                    row = db.execute(
+                        "SELECT doc_id, " + ", ".join(COLUMNS) + " FROM documents "
+                        "WHERE start_idx <= ? ORDER BY start_idx DESC, end_idx DESC LIMIT 1",
+                        (chunk_id,),
+                    ).fetchone()
+                    doc = {"id": row[0], **self._row(row[1:])} if row else {}
+                    cache[chunk_id] = doc if doc and chunk_id < doc["end_idx"] else {}
+                results.append(cache[chunk_id])
+        return results
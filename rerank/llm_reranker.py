@@ -1,40 +1,175 @@
-from openai import OpenAI
-from google import genai
+import asyncio
+import json
+import math
+import os
+import re
 from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
 
 load_dotenv()  # Load environment variables from .env file
-client = OpenAI()
-gemini = genai.Client()
 
-def llm_rerank(query, documents):
-    """
-    documents = list of dicts:
-    [{"id": "...", "text": "...", "metadata": {...}}, ...]
-    """
-    prompt = f"""
-You are a ranking model. Rank the following documents by relevance to the query.
-Return a JSON list of objects: id and score (0–1).
+PROMPT = """
+You are a ranking model. Score each document by relevance to the query.
+Return only a JSON list of objects with "id" and "score" (0-1), one per document.
 
 Query: {query}
 
 Documents:
 {documents}
 """
-    response = gemini.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-        temperature=0
-    )
-
-    import json
-    try:
-        ranking = json.loads(response.choices[0].message.content)
-    except Exception:
-        print("LLM Formatting Error: Using fallback")
-        return documents
-    
-    # Sort original documents by LLM score
-    doc_scores = {item["id"]: item["score"] for item in ranking}
-    reranked = sorted(documents, key=lambda d: doc_scores.get(d["id"], 0), reverse=True)
-
-    return reranked
+
+
+class LLMReranker:
+    def __init__(self, fallback=None, provider: Optional[str] = None, model: Optional[str] = None,
+                 base_url: Optional[str] = None, batch_size: int = 8, timeout: float = 10.0,
+                 max_concurrency: int = 4, max_chars: int = 1500):
+        """
+        Async LLM reranker. Candidates are split into batches scored in parallel,
+        each call is bounded by `timeout` seconds, and any batch that times out,
+        errors or returns malformed JSON (or skips documents) is scored by the
+        fallback cross-encoder instead, so a ranking is always returned.
+
+        Args:
+            fallback: Reranker whose rerank_with_metadata scores replace failed
+                      LLM batches; without one, failed documents keep their order.
+            provider: "gemini" or "openai" (any OpenAI-compatible server).
+            model: Model name; defaults per provider.
+            base_url: API endpoint override, e.g. a local stand-in server for tests.
+            batch_size: Documents per LLM call.
+            timeout: Deadline per LLM call, in seconds.
+            max_concurrency: LLM calls in flight per rerank.
+            max_chars: Each document is truncated to this many characters in the prompt.
+        """
+        self.fallback = fallback
+        self.provider = provider or os.getenv("LLM_RERANK_PROVIDER", "gemini")
+        self.model = model or os.getenv("LLM_RERANK_MODEL") or (
+            "gemini-2.0-flash" if self.provider == "gemini" else "gpt-4o-mini")
+        self.base_url = base_url or os.getenv("LLM_RERANK_BASE_URL")
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_chars = max_chars
+        self._client = None  # created on first use, not at import time
+        self.llm_batches = 0
+        self.fallback_batches = 0
+
+    # -----------------------------------------------------------
+    # LLM client (lazy)
+    # -----------------------------------------------------------
+    def _get_client(self):
+        if self._client is None:
+            if self.provider == "gemini":
+                from google import genai
+                http_options = {"base_url": self.base_url} if self.base_url else None
+                self._client = genai.Client(http_options=http_options)
+            elif self.provider == "openai":
+                from openai import AsyncOpenAI
+                self._client = AsyncOpenAI(base_url=self.base_url) if self.base_url else AsyncOpenAI()
+            else:
+                raise ValueError(f"Unknown LLM rerank provider: {self.provider}")
+        return self._client
+
+    async def _complete(self, prompt: str) -> str:
+        client = self._get_client()
+        if self.provider == "gemini":
+            response = await client.aio.models.generate_content(
+                model=self.model,
+                contents=prompt,
+                config={"temperature": 0, "response_mime_type": "application/json"},
+            )
+            return response.text
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+        )
+        return response.choices[0].message.content
+
+    # -----------------------------------------------------------
+    # Batch scoring
+    # -----------------------------------------------------------
+    def _prompt(self, query: str, batch: List[Dict[str, Any]]) -> str:
+        # Documents are numbered within the batch; the model only has to echo the number
+        documents = [{"id": str(i), "text": doc["text"][:self.max_chars]} for i, doc in enumerate(batch)]
+        return PROMPT.format(query=query, documents=json.dumps(documents, ensure_ascii=False, indent=1))
+
+    @staticmethod
+    def _parse(text: str, count: int) -> List[float]:
+        "Scores in batch order; raises ValueError unless every document got a valid score"
+        text = re.sub(r"^```(?:json)?|```$", "", text.strip()).strip()
+        items = json.loads(text)
+        if isinstance(items, dict):
+            items = items.get("ranking") or items.get("results") or []
+        scores: Dict[int, float] = {}
+        for item in items:
+            position, score = int(item["id"]), float(item["score"])
+            if 0 <= position < count and math.isfinite(score):
+                scores[position] = min(max(score, 0.0), 1.0)
+        if len(scores) != count:
+            raise ValueError(f"LLM scored {len(scores)} of {count} documents")
+        return [scores[i] for i in range(count)]
+
+    async def _fallback_scores(self, query: str, batch: List[Dict[str, Any]]) -> List[float]:
+        if self.fallback is None:
+            return [0.0] * len(batch)
+        copies = [dict(doc) for doc in batch]  # rerank_with_metadata writes "score" into each dict
+        await asyncio.to_thread(self.fallback.rerank_with_metadata, query, copies, len(copies))
+        # Squash cross-encoder logits into the LLM's 0-1 range so the batches merge
+        return [1.0 / (1.0 + math.exp(-float(doc["score"]))) for doc in copies]
+
+    async def _score_batch(self, query: str, batch: List[Dict[str, Any]], semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                text = await asyncio.wait_for(self._complete(self._prompt(query, batch)), self.timeout)
+                scores = self._parse(text, len(batch))
+                self.llm_batches += 1
+                return scores, "llm"
+            except asyncio.TimeoutError:
+                print(f"⚠️ LLM rerank timed out after {self.timeout}s: using fallback")
+            except Exception as e:
+                print(f"⚠️ LLM rerank failed ({e}): using fallback")
+        self.fallback_batches += 1
+        return await self._fallback_scores(query, batch), "fallback"
+
+    # -----------------------------------------------------------
+    # Public API
+    # -----------------------------------------------------------
+    async def arerank(self, query: str, documents: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        documents = list of dicts:
+        [{"id": "...", "text": "...", "metadata": {...}}, ...]
+        Returns copies sorted by "score", each tagged with "rerank_source" ("llm" or "fallback").
+        """
+        if not documents:
+            return []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [documents[i:i + self.batch_size] for i in range(0, len(documents), self.batch_size)]
+        results = await asyncio.gather(*(self._score_batch(query, batch, semaphore) for batch in batches))
+
+        ranked = []
+        for batch, (scores, source) in zip(batches, results):
+            for doc, score in zip(batch, scores):
+                ranked.append({**doc, "score": score, "rerank_source": source})
+        ranked.sort(key=lambda d: d["score"], reverse=True)  # stable: ties keep retrieval order
+        return ranked[:top_k] if top_k else ranked
+
+    def rerank(self, query: str, documents: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        "Blocking arerank() for synchronous callers (not from inside a running event loop)"
+        return asyncio.run(self.arerank(query, documents, top_k))
+
+    def stats(self) -> Dict[str, int]:
+        return {"llm_batches": self.llm_batches, "fallback_batches": self.fallback_batches}
+
+
+_default_reranker: Optional[LLMReranker] = None
+
+
+def llm_rerank(query, documents):
+    """
+    documents = list of dicts:
+    [{"id": "...", "text": "...", "metadata": {...}}, ...]
+    """
+    global _default_reranker
+    if _default_reranker is None:
+        _default_reranker = LLMReranker()
+    return _default_reranker.rerank(query, documents)
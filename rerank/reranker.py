@@ -1,43 +1,195 @@
-from sentence_transformers import CrossEncoder
-from typing import List, Dict, Any, Tuple
-from .llm_reranker import llm_rerank
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+from embeddings.batcher import MicroBatcher
+from .llm_reranker import LLMReranker
 
 
 class Reranker:
-    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2'):
-        self.model = CrossEncoder(model_name)
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', batch_size: int = 32,
+                 max_length: int = 256, cache_size: int = 20000, max_wait_ms: float = 5.0):
+        """
+        Cross-encoder reranker.
+
+        Args:
+            model_name: sentence-transformers CrossEncoder model.
+            batch_size: Pairs per forward pass.
+            max_length: Token budget per (query, document) pair; longer pairs are
+                        truncated, which bounds the cost of huge chunks.
+            cache_size: (query, chunk) scores kept in an LRU cache, so chunks
+                        scored for the same question in an earlier turn are free.
+            max_wait_ms: Window for coalescing concurrent arerank() calls into
+                        shared forward passes.
+        """
+        self.model_name = model_name
+        self._model = None  # loaded on first use (or by load()), not at construction
+        self._load_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, Any], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._batcher = MicroBatcher(self._predict, max_batch=batch_size, max_wait_ms=max_wait_ms)
+        self._llm_reranker: Optional[LLMReranker] = None
+        self.hits = 0
+        self.misses = 0
+
+    # -----------------------------------------------------------
+    # Model (lazy)
+    # -----------------------------------------------------------
+    def load(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        return self.load()
+
+    def warmup(self):
+        "Score one pair outside the cache so the first real request doesn't pay for allocation"
+        self._predict([("warmup", "warmup")])
+
+    # -----------------------------------------------------------
+    # Scoring with cache
+    # -----------------------------------------------------------
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        "Raw cross-encoder scores; pairs are run longest-first so batches pad evenly"
+        scores = np.empty(len(pairs), dtype=np.float32)
+        if not pairs:
+            return scores
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]), reverse=True)
+        scores[order] = self.model.predict(
+            [pairs[i] for i in order],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        return scores
+
+    def _keys(self, query: str, documents: List[str], ids: Optional[Sequence[Any]]) -> List[Tuple[str, Any]]:
+        "Cache keys: (query hash, chunk id), or a hash of the text when no id is known"
+        query_hash = hashlib.blake2b(query.encode("utf-8"), digest_size=16).hexdigest()
+        if ids is None:
+            ids = [hashlib.blake2b(doc.encode("utf-8"), digest_size=16).hexdigest() for doc in documents]
+        return [(query_hash, doc_id) for doc_id in ids]
 
-    def rerank(self, query: str, documents: List[str], top_k: int = 5) -> List[Tuple[str, float]]:
+    def _lookup(self, keys) -> Tuple[np.ndarray, List[int]]:
+        "Cached scores (NaN where missing) and the positions that still need scoring"
+        scores = np.full(len(keys), np.nan, dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._cache.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    scores[i] = score
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return scores, missing
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = float(score)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, query: str, documents: List[str], ids: Optional[Sequence[Any]] = None) -> np.ndarray:
+        "Cross-encoder scores of the documents for the query, served from cache where possible"
+        keys = self._keys(query, documents, ids)
+        scores, missing = self._lookup(keys)
+        if missing:
+            computed = self._predict([(query, documents[i]) for i in missing])
+            scores[missing] = computed
+            self._store([keys[i] for i in missing], computed)
+        return scores
+
+    async def ascore(self, query: str, documents: List[str], ids: Optional[Sequence[Any]] = None) -> np.ndarray:
+        "score(), with cache misses micro-batched together with other concurrent requests"
+        keys = self._keys(query, documents, ids)
+        scores, missing = self._lookup(keys)
+        if missing:
+            computed = await asyncio.gather(*(self._batcher.submit((query, documents[i])) for i in missing))
+            scores[missing] = computed
+            self._store([keys[i] for i in missing], computed)
+        return scores
+
+    # -----------------------------------------------------------
+    # Ranking
+    # -----------------------------------------------------------
+    @staticmethod
+    def _ranked(documents: List[str], scores: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [(documents[i], float(scores[i])) for i in order]
+
+    def rerank(self, query: str, documents: List[str], top_k: int = 5,
+               ids: Optional[Sequence[Any]] = None) -> List[Tuple[str, float]]:
         """
         Returns: List of (document, score) sorted by score desc
+        ids: optional chunk ids of the documents, used as cache keys
         """
-        pairs = [[query, doc] for doc in documents]
-        scores = self.model.predict(pairs)
+        return self._ranked(documents, self.score(query, documents, ids), top_k)
 
-        ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
-        return ranked[:top_k]  
+    async def arerank(self, query: str, documents: List[str], top_k: int = 5,
+                      ids: Optional[Sequence[Any]] = None) -> List[Tuple[str, float]]:
+        "rerank() for async callers; concurrent requests share cross-encoder batches"
+        return self._ranked(documents, await self.ascore(query, documents, ids), top_k)
 
     def rerank_with_metadata(self, query: str, documents: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
         """
         documents = list of dicts:
         [{"id": "...", "text": "...", "metadata": {...}}, ...]
         """
-        pairs = [[query, doc["text"]] for doc in documents]
-        scores = self.model.predict(pairs)
+        ids = [doc["id"] for doc in documents] if all("id" in doc for doc in documents) else None
+        scores = self.score(query, [doc["text"] for doc in documents], ids)
 
         for doc, score in zip(documents, scores):
-            doc["score"] = score
+            doc["score"] = float(score)
 
         ranked = sorted(documents, key=lambda x: x["score"], reverse=True)
         return ranked[:top_k]
 
-    
+    def stats(self) -> Dict[str, Any]:
+        "Score-cache counters and micro-batching stats"
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cache_entries": len(self._cache),
+            "batching": self._batcher.stats(),
+            "llm": self._llm_reranker.stats() if self._llm_reranker is not None else None,
+        }
+
+
+    @property
+    def llm_reranker(self) -> LLMReranker:
+        "LLM reranker that falls back to this cross-encoder; its client is only built on first use"
+        if self._llm_reranker is None:
+            self._llm_reranker = LLMReranker(fallback=self)
+        return self._llm_reranker
+
     def llm_rerank(self, query: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         documents = list of dicts:
         [{"id": "...", "text": "...", "metadata": {...}}, ...]
         """
-        return llm_rerank(query, documents)
-
+        return self.llm_reranker.rerank(query, documents)
 
-    
\ No newline at end of file
+    async def allm_rerank(self, query: str, documents: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self.llm_reranker.arerank(query, documents, top_k)
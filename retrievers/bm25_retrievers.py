@@ -1,32 +1,381 @@
-from rank_bm25 import BM25Okapi
+import math
 import re
-from typing import List, Optional, Tuple
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+class _GrowableArray:
+    "Append-only numpy array with amortized O(1) appends (capacity doubling)"
+
+    def __init__(self, dtype, capacity: int = 4):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        end = self.size + len(values)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    def view(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "_GrowableArray":
+        array = cls(values.dtype, max(len(values), 4))
+        array.extend(values)
+        return array
+
+
+def _top_k(positions: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k best (position, score) pairs, best first, ties broken by position.
+    A partition finds the k-th score in O(n); only the pairs at or above it are sorted.
+    """
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = scores >= kth
+        positions, scores = positions[above], scores[above]
+    order = np.lexsort((positions, -scores))[:k]
+    return positions[order], scores[order]
 
 
 class BM25Retriever:
-    def __init__(self, text_chunks: Optional[List[str]]=None):
-        self.text_chunks = text_chunks or []    
-        self.tokenized_chunks = [self._tokenize(chunk) for chunk in self.text_chunks]
-        
-        if self.tokenized_chunks:
-            self.bm25 = BM25Okapi(self.tokenized_chunks)
-        else:
-            self.bm25 = None
+    def __init__(self, text_chunks: Optional[List[str]]=None, chunk_ids: Optional[List[int]]=None,
+                 k1: float = 1.5, b: float = 0.75, max_deleted_ratio: float = 0.2,
+                 texts: Optional[Callable[[List[int]], List[str]]] = None):
+        """
+        Okapi BM25 over an incrementally maintained inverted index.
+
+        Each term maps to a postings list of (document position, term frequency);
+        document lengths and document frequencies are kept alongside, so adding
+        chunks only tokenizes and indexes the new ones, and a query only touches
+        the postings of its own terms. Top-k retrieval uses MaxScore pruning on
+        per-term score upper bounds, so long postings of common terms are only
+        probed for documents that can still make the top k.
+
+        Args:
+            text_chunks: Initial chunks to index.
+            chunk_ids: Stable chunk ids shared with the vector store; default to positions.
+            k1, b: BM25 term-frequency saturation and length normalisation.
+            max_deleted_ratio: Fraction of tombstoned chunks that makes compaction due.
+            texts: Resolves chunk ids to their texts (e.g. from the vector store's
+                   chunk registry), so the index keeps no copy of its own; without
+                   it the texts are kept here for retrieve().
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_deleted_ratio = max_deleted_ratio
+        self.texts = texts
+        self._own_texts: Dict[int, str] = {}  # only when no texts resolver is given
+        self.chunk_ids: List[int] = []
+        self.deleted_ids = set()
+        self._postings: Dict[str, Tuple[_GrowableArray, _GrowableArray]] = {}
+        # Per-term (max tf, min doc length) over its postings, for score upper bounds
+        self._term_bounds: Dict[str, Tuple[float, float]] = {}
+        self._doc_len = _GrowableArray(np.float32)
+        self._total_len = 0
+        self._positions: Dict[int, int] = {}  # chunk id -> position
+        self._ids = _GrowableArray(np.int64)  # position -> chunk id, for metadata filters
+        self._dead = _GrowableArray(np.bool_)
+
+        if text_chunks:
+            self.add_documents(text_chunks, chunk_ids)
 
     def _tokenize(self, text: str) -> List[str]:
         # Simple tokenization: lowercase and split on non-alphanumeric characters
         return re.findall(r'\w+', text.lower())
 
-    def add_documents(self, new_texts: List[str]):
-        self.text_chunks.extend(new_texts)
-        self.tokenized_chunks = [self._tokenize(chunk) for chunk in self.text_chunks]  
-        self.bm25 = BM25Okapi(self.tokenized_chunks)
-
-    def retrieve(self, query: str, top_k: int = 5) -> List[str]:
-        if self.bm25 is None:
-            return [], []
-        tokenized_query = self._tokenize(query)
-        scores = self.bm25.get_scores(tokenized_query)
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-        return [self.text_chunks[i] for i in top_indices], [scores[i] for i in top_indices]       
-    
\ No newline at end of file
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def _resolve(self, ids: List[int]) -> List[str]:
+        if self.texts is not None:
+            return self.texts(ids)
+        return [self._own_texts[i] for i in ids]
+
+    def __contains__(self, chunk_id) -> bool:
+        "True if the chunk id was indexed (deleted chunks count until compaction)"
+        return int(chunk_id) in self._positions
+
+    # -----------------------------------------------------------
+    # Indexing
+    # -----------------------------------------------------------
+    def add_documents(self, new_texts: List[str], ids: Optional[Iterable[int]] = None):
+        if ids is None:
+            start = self.chunk_ids[-1] + 1 if self.chunk_ids else 0
+            ids = range(start, start + len(new_texts))
+        ids = [int(i) for i in ids]
+
+        # Group the new postings per term so each list grows once per call
+        first = len(self.chunk_ids)
+        new_postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for position, text in enumerate(new_texts, start=first):
+            tokens = self._tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                docs, tfs = new_postings.setdefault(term, ([], []))
+                docs.append(position)
+                tfs.append(tf)
+
+        for term, (docs, tfs) in new_postings.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (_GrowableArray(np.int64), _GrowableArray(np.float32))
+            postings[0].extend(docs)
+            postings[1].extend(tfs)
+            max_tf = max(tfs)
+            min_len = min(lengths[d - first] for d in docs)
+            bound = self._term_bounds.get(term)
+            if bound is not None:
+                max_tf, min_len = max(max_tf, bound[0]), min(min_len, bound[1])
+            self._term_bounds[term] = (max_tf, min_len)
+
+        if self.texts is None:
+            self._own_texts.update(zip(ids, new_texts))
+        self.chunk_ids.extend(ids)
+        self._positions.update(zip(ids, range(first, first + len(ids))))
+        self._doc_len.extend(lengths)
+        self._total_len += sum(lengths)
+        self._ids.extend(ids)
+        self._dead.extend(np.zeros(len(ids), dtype=np.bool_))
+
+    def delete(self, ids: Iterable[int]) -> int:
+        "Tombstone chunks by id; they are skipped at once and dropped by compact()"
+        positions = []
+        for chunk_id in ids:
+            chunk_id = int(chunk_id)
+            position = self._positions.get(chunk_id)
+            if position is not None and chunk_id not in self.deleted_ids:
+                self.deleted_ids.add(chunk_id)
+                positions.append(position)
+        self._dead.view()[positions] = True
+        return len(positions)
+
+    def needs_compaction(self) -> bool:
+        return len(self.deleted_ids) > self.max_deleted_ratio * max(len(self.chunk_ids), 1)
+
+    def compact(self):
+        "Physically drop tombstoned chunks, remapping postings to the new positions"
+        self.apply_compaction(self.prepare_compaction())
+
+    def prepare_compaction(self) -> dict:
+        """
+        Build the compacted index without touching this one, so it can run
+        alongside searches. No documents may be added until apply_compaction().
+        """
+        alive = ~self._dead.view()
+        new_position = np.cumsum(alive) - 1
+        old_len = self._doc_len.view()
+        postings, bounds = {}, {}
+        for term, (docs, tfs) in self._postings.items():
+            docs, tfs = docs.view(), tfs.view()
+            keep = alive[docs]
+            if keep.any():
+                docs, tfs = docs[keep], tfs[keep]
+                postings[term] = (_GrowableArray.of(new_position[docs]), _GrowableArray.of(tfs))
+                bounds[term] = (float(tfs.max()), float(old_len[docs].min()))
+
+        keep = np.flatnonzero(alive)
+        doc_len = old_len[keep]
+        chunk_ids = [self.chunk_ids[i] for i in keep]
+        return {
+            "postings": postings,
+            "term_bounds": bounds,
+            "doc_len": _GrowableArray.of(doc_len),
+            "total_len": int(doc_len.sum()),
+            "chunk_ids": chunk_ids,
+            "ids": _GrowableArray.of(np.asarray(chunk_ids, dtype=np.int64)),
+            "positions": {chunk_id: i for i, chunk_id in enumerate(chunk_ids)},
+            "dropped": set(self.deleted_ids),
+        }
+
+    def apply_compaction(self, state: dict):
+        "Swap in a prepared compaction; chunks deleted since it was prepared stay tombstoned"
+        late_deletes = self.deleted_ids - state["dropped"]
+        self._postings = state["postings"]
+        self._term_bounds = state["term_bounds"]
+        self._doc_len = state["doc_len"]
+        self._total_len = state["total_len"]
+        self._dead = _GrowableArray.of(np.zeros(len(state["chunk_ids"]), dtype=np.bool_))
+        self.chunk_ids = state["chunk_ids"]
+        for chunk_id in state["dropped"]:
+            self._own_texts.pop(chunk_id, None)
+        self._ids = state["ids"]
+        self._positions = state["positions"]
+        self.deleted_ids = set()
+        self.delete(late_deletes)
+
+    # -----------------------------------------------------------
+    # Scoring
+    # -----------------------------------------------------------
+    def _idf(self, df: int) -> float:
+        # Non-negative BM25 idf; depends only on df and N, so it stays current
+        # as documents are added without recomputing anything corpus-wide
+        n = len(self.chunk_ids)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def _term_scores(self, term: str, weight: float, doc_len: np.ndarray, avgdl: float):
+        "(positions, scores) contributed by one query term, read straight from its postings"
+        docs, tfs = self._postings[term]
+        docs, tfs = docs.view(), tfs.view()
+        norm = self.k1 * (1.0 - self.b + self.b * doc_len[docs] / avgdl)
+        return docs, weight * (self._idf(len(docs)) * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+    def _upper_bound(self, term: str, weight: float, avgdl: float) -> float:
+        "No document can get more than this from the term: max tf at the shortest length"
+        max_tf, min_len = self._term_bounds[term]
+        norm = self.k1 * (1.0 - self.b + self.b * min_len / avgdl)
+        return weight * self._idf(self._postings[term][0].size) * max_tf * (self.k1 + 1.0) / (max_tf + norm)
+
+    def _query_terms(self, query: str) -> Counter:
+        return Counter(t for t in self._tokenize(query) if t in self._postings)
+
+    def _avgdl(self) -> float:
+        return max(self._total_len / len(self.chunk_ids), 1e-9)
+
+    def _excluded(self, allowed: Optional[np.ndarray]) -> np.ndarray:
+        "Positions that may not be returned: tombstoned, or outside the allowed chunk-id bitmap"
+        dead = self._dead.view()
+        if allowed is None:
+            return dead
+        ids = self._ids.view()
+        inside = ids < len(allowed)
+        excluded = np.ones(len(ids), dtype=np.bool_)
+        excluded[inside] = ~allowed[ids[inside]]
+        return excluded | dead
+
+    def _score(self, query: str, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        "Exhaustive scoring: positions of live (allowed) chunks matching any query term, with their BM25 scores"
+        query_terms = self._query_terms(query)
+        if not query_terms or not self.chunk_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        doc_len = self._doc_len.view()
+        avgdl = self._avgdl()
+        parts = [self._term_scores(term, qtf, doc_len, avgdl) for term, qtf in query_terms.items()]
+        positions, inverse = np.unique(np.concatenate([docs for docs, _ in parts]), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate([s for _, s in parts]))
+
+        alive = ~self._excluded(allowed)[positions]
+        return positions[alive], scores[alive]
+
+    def _max_score(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        MaxScore top-k, term at a time in decreasing upper-bound order.
+
+        While some terms are left, an unseen document can score at most the sum
+        of their upper bounds. Once that is below the current k-th best partial
+        score, no new document can enter the top k: the remaining (low-idf,
+        long) postings are then only probed by binary search for the surviving
+        candidates, and candidates that can no longer reach the threshold are
+        dropped. With an allowed bitmap, postings of other chunks are dropped
+        before they become candidates, so the threshold is the k-th best
+        allowed score and pruning works as in an unfiltered query.
+        """
+        query_terms = self._query_terms(query)
+        if not query_terms or not self.chunk_ids or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        doc_len = self._doc_len.view()
+        dead = self._excluded(allowed)
+        avgdl = self._avgdl()
+        bounds = {term: self._upper_bound(term, qtf, avgdl) for term, qtf in query_terms.items()}
+        order = sorted(query_terms, key=bounds.get, reverse=True)
+        # remaining[i]: most a document can still gain from the terms after order[i]
+        remaining = np.cumsum([bounds[term] for term in reversed(order)])[::-1].tolist()[1:] + [0.0]
+
+        candidates = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float64)
+        closed = False  # True once unseen documents can no longer make the top k
+        for i, term in enumerate(order):
+            weight = query_terms[term]
+            if not closed:
+                docs, term_scores = self._term_scores(term, weight, doc_len, avgdl)
+                if allowed is not None:
+                    keep = ~dead[docs]
+                    docs, term_scores = docs[keep], term_scores[keep]
+                candidates, inverse = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, term_scores]))
+            else:
+                docs, tfs = self._postings[term]
+                docs, tfs = docs.view(), tfs.view()
+                found = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[found] == candidates
+                found = found[hit]
+                norm = self.k1 * (1.0 - self.b + self.b * doc_len[docs[found]] / avgdl)
+                scores[hit] += weight * (self._idf(len(docs)) * tfs[found] * (self.k1 + 1.0) / (tfs[found] + norm))
+
+            alive = ~dead[candidates]
+            if alive.sum() < top_k:
+                continue
+            threshold = np.partition(scores[alive], -top_k)[-top_k]
+            if remaining[i] < threshold:
+                closed = True
+            if closed:
+                keep = alive & (scores + remaining[i] >= threshold)
+                candidates, scores = candidates[keep], scores[keep]
+
+        alive = ~dead[candidates]
+        return _top_k(candidates[alive], scores[alive], top_k)
+
+    def _top(self, query: str, top_k: int, prune: bool, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if prune:
+            return self._max_score(query, top_k, allowed)
+        return _top_k(*self._score(query, allowed), top_k)
+
+    def retrieve(self, query: str, top_k: int = 5, prune: bool = True,
+                 allowed: Optional[np.ndarray] = None) -> Tuple[List[str], List[float]]:
+        """
+        Top-k chunks for the query, best first, with their BM25 scores.
+        prune=False scores every matching chunk (same results, no MaxScore).
+        allowed: optional boolean bitmap over chunk ids (see MetadataIndex); top-k is taken over those only.
+        Texts are resolved only for the returned chunks.
+        """
+        positions, scores = self._top(query, top_k, prune, allowed)
+        return self._resolve([self.chunk_ids[i] for i in positions]), scores.tolist()
+
+    def retrieve_ids(self, query: str, top_k: int = 5, prune: bool = True,
+                     allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        "Like retrieve(), but returns stable chunk ids instead of texts"
+        positions, scores = self._top(query, top_k, prune, allowed)
+        return np.array([self.chunk_ids[i] for i in positions], dtype=np.int64), scores
+
+    def retrieve_ids_batch(self, queries: List[str], top_k: int = 5,
+                           allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        retrieve_ids for many queries. Each distinct term's postings are scored
+        once for the whole batch, so terms shared between queries (typically the
+        long, common ones) cost the same as in a single query.
+        """
+        if not self.chunk_ids:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)) for _ in queries]
+
+        doc_len = self._doc_len.view()
+        dead = self._excluded(allowed)
+        avgdl = self._avgdl()
+        chunk_ids = np.asarray(self.chunk_ids, dtype=np.int64)
+        term_scores: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        results = []
+        for query in queries:
+            query_terms = self._query_terms(query)
+            if not query_terms:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+                continue
+            for term in query_terms:
+                if term not in term_scores:
+                    term_scores[term] = self._term_scores(term, 1.0, doc_len, avgdl)
+            docs = np.concatenate([term_scores[term][0] for term in query_terms])
+            weights = np.concatenate([qtf * term_scores[term][1] for term, qtf in query_terms.items()])
+            positions, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+            alive = ~dead[positions]
+            positions, scores = _top_k(positions[alive], scores[alive], top_k)
+            results.append((chunk_ids[positions], scores))
+        return results
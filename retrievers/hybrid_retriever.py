@@ -1,84 +1,164 @@
 import numpy as np
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Shared by all HybridRetriever instances (the API builds some per request);
+# faiss releases the GIL, so the vector leg overlaps with BM25 scoring
+_LEG_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-leg")
+
+FUSION_METHODS = ("weighted", "rrf")
 
 
 class HybridRetriever:
-    def __init__(self, vector_store, bm25_retriever, alpha: float = 0.5):
+    def __init__(self, vector_store, bm25_retriever, alpha: float = 0.5, fusion: str = "weighted",
+                 rrf_k: int = 60, fetch_k: Optional[int] = None):
         """
         Hybrid Retriever combining vector and BM25 retrievers.
 
+        Both legs return stable chunk ids, so results are fused by id and the
+        chunk texts are only looked up for the final top_k.
+
         Args:
-            vector_store: Object with .search(query_emb, top_k) → list of dicts/tuples/strings
-            bm25_retriever: Object with .retrieve(query_text, top_k) → (results, scores)
-            alpha: Weight for vector similarity vs BM25 lexical score.
+            vector_store: Object with .search_ids(query_emb, top_k) → (ids, L2 distances)
+                          and .get_chunks(ids) → (texts, metadata)
+            bm25_retriever: Object with .retrieve_ids(query_text, top_k) → (ids, scores)
+            alpha: Weight for vector similarity vs BM25 lexical score ("weighted" fusion).
                    alpha=0.7 → more semantic; alpha=0.3 → more lexical.
+            fusion: "weighted" (alpha-weighted normalised scores) or "rrf"
+                    (reciprocal rank fusion, ignores score scales).
+            rrf_k: Rank offset for RRF; larger values flatten the rank weights.
+            fetch_k: Candidates taken from each leg (default: top_k).
         """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"fusion must be one of {FUSION_METHODS}, got {fusion!r}")
         self.vector_store = vector_store
         self.bm25_retriever = bm25_retriever
         self.alpha = alpha
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.fetch_k = fetch_k
 
     # -----------------------------------------------------------
-    # Helper: extract clean text strings from any retriever output
+    # Score fusion
     # -----------------------------------------------------------
-    def _extract_texts(self, results):
-        """Extract text strings safely from various retriever result formats."""
-        texts = []
-        if not results:
-            return texts
-
-        for item in results:
-            # Case 1: dict → try multiple possible text keys
-            if isinstance(item, dict):
-                for key in ["text", "chunk", "content", "document"]:
-                    if key in item and isinstance(item[key], str):
-                        texts.append(item[key])
-                        break  # use the first valid field
-
-            # Case 2: tuple/list → first element is text
-            elif isinstance(item, (list, tuple)) and len(item) > 0:
-                if isinstance(item[0], str):
-                    texts.append(item[0])
-
-            # Case 3: plain string
-            elif isinstance(item, str):
-                texts.append(item)
-
-        # Return only valid unique strings
-        return [str(t) for t in texts if isinstance(t, str)]
+    @staticmethod
+    def _normalise_distances(distances: np.ndarray) -> np.ndarray:
+        "Map L2 distances to [0, 1] similarities, nearest = 1"
+        if distances.size == 0:
+            return distances
+        spread = distances.max() - distances.min()
+        if spread <= 0:
+            return np.ones_like(distances)
+        return 1.0 - (distances - distances.min()) / spread
+
+    @staticmethod
+    def _normalise_scores(scores: np.ndarray) -> np.ndarray:
+        if scores.size == 0 or scores.max() <= 0:
+            return np.zeros_like(scores)
+        return scores / scores.max()
+
+    def _fuse(self, vector_ids, vector_distances, bm25_ids, bm25_scores, fusion: str, alpha: float) -> Dict[int, float]:
+        fused: Dict[int, float] = {}
+        if fusion == "rrf":
+            for ids in (vector_ids, bm25_ids):
+                for rank, chunk_id in enumerate(ids.tolist()):
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            return fused
+
+        for chunk_id, score in zip(vector_ids.tolist(), self._normalise_distances(vector_distances).tolist()):
+            fused[chunk_id] = alpha * score
+        for chunk_id, score in zip(bm25_ids.tolist(), self._normalise_scores(bm25_scores).tolist()):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + (1 - alpha) * score
+        return fused
 
     # -----------------------------------------------------------
     # Main hybrid retrieval
     # -----------------------------------------------------------
-    def retrieve(self, query_emb: np.ndarray, query_text: str, top_k: int = 5) -> List[str]:
-        # --- Vector retrieval ---
-        vector_results_raw = self.vector_store.search(query_emb, top_k=top_k)
-        vector_results = self._extract_texts(vector_results_raw)
-        vector_score = np.linspace(1.0, 0.0, num=len(vector_results))  # descending semantic score
-
-        # --- BM25 retrieval ---
-        bm25_results_raw, bm25_scores = self.bm25_retriever.retrieve(query_text, top_k=top_k)
-        bm25_results = self._extract_texts(bm25_results_raw)
-        bm25_score = np.array(bm25_scores, dtype=float)
-
-        # Normalize BM25 scores safely
-        if bm25_score.size > 0 and bm25_score.max() > 0:
-            bm25_score = bm25_score / bm25_score.max()
+    def search(self, query_emb: np.ndarray, query_text: str, top_k: int = 5,
+               fusion: Optional[str] = None, alpha: Optional[float] = None,
+               allowed: Optional[np.ndarray] = None) -> List[dict]:
+        """
+        Fused top_k hits, best first, as dicts with id, score, text, metadata
+        and the raw per-leg vector_distance / bm25_score (None if a leg missed it).
+        allowed: optional chunk-id bitmap (see MetadataIndex) pushed into both legs.
+        """
+        fusion = fusion or self.fusion
+        alpha = self.alpha if alpha is None else alpha
+        fetch_k = max(self.fetch_k or top_k, top_k)
+
+        # --- Run both legs concurrently ---
+        if allowed is None:
+            vector_leg = _LEG_POOL.submit(self.vector_store.search_ids, query_emb, fetch_k)
+            bm25_ids, bm25_scores = self.bm25_retriever.retrieve_ids(query_text, top_k=fetch_k)
         else:
-            bm25_score = np.zeros_like(bm25_score)
+            vector_leg = _LEG_POOL.submit(self.vector_store.search_ids, query_emb, fetch_k, allowed)
+            bm25_ids, bm25_scores = self.bm25_retriever.retrieve_ids(query_text, top_k=fetch_k, allowed=allowed)
+        vector_ids, vector_distances = vector_leg.result()
 
-        # --- Combine results ---
-        all_texts = list(set(vector_results + bm25_results))  # now guaranteed all are strings
-        combined_scores = []
+        best = self._fuse_top(vector_ids, vector_distances, bm25_ids, bm25_scores, top_k, fusion, alpha)
+        return self._hits([best])[0]
 
-        for text in all_texts:
-            v_score = vector_score[vector_results.index(text)] if text in vector_results else 0.0
-            b_score = bm25_score[bm25_results.index(text)] if text in bm25_results else 0.0
-            combined_score = self.alpha * v_score + (1 - self.alpha) * b_score
-            combined_scores.append((text, combined_score))
+    def search_batch(self, query_embs: np.ndarray, query_texts: List[str], top_k: int = 5,
+                     fusion: Optional[str] = None, alpha: Optional[float] = None,
+                     allowed: Optional[np.ndarray] = None) -> List[List[dict]]:
+        """
+        search() for many queries: one multi-row vector search and one batched
+        BM25 pass (run concurrently), then a single chunk lookup for all hits.
+        """
+        fusion = fusion or self.fusion
+        alpha = self.alpha if alpha is None else alpha
+        fetch_k = max(self.fetch_k or top_k, top_k)
 
-        # --- Sort by combined score ---
-        combined_scores.sort(key=lambda x: x[1], reverse=True)
-        return [text for text, _ in combined_scores[:top_k]]
+        if allowed is None:
+            vector_leg = _LEG_POOL.submit(self.vector_store.search_ids_batch, query_embs, fetch_k)
+            bm25_results = self.bm25_retriever.retrieve_ids_batch(query_texts, top_k=fetch_k)
+        else:
+            vector_leg = _LEG_POOL.submit(self.vector_store.search_ids_batch, query_embs, fetch_k, allowed)
+            bm25_results = self.bm25_retriever.retrieve_ids_batch(query_texts, top_k=fetch_k, allowed=allowed)
+        vector_results = vector_leg.result()
+
+        bests = [
+            self._fuse_top(vector_ids, vector_distances, bm25_ids, bm25_scores, top_k, fusion, alpha)
+            for (vector_ids, vector_distances), (bm25_ids, bm25_scores) in zip(vector_results, bm25_results)
+        ]
+        return self._hits(bests)
+
+    def _fuse_top(self, vector_ids, vector_distances, bm25_ids, bm25_scores, top_k, fusion, alpha) -> List[tuple]:
+        "Fuse by chunk id; (id, score, vector_distance, bm25_score) of the top_k, best first"
+        fused = self._fuse(vector_ids, vector_distances, bm25_ids, bm25_scores, fusion, alpha)
+        best = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+        distance_of = dict(zip(vector_ids.tolist(), vector_distances.tolist()))
+        bm25_of = dict(zip(bm25_ids.tolist(), bm25_scores.tolist()))
+        return [(chunk_id, score, distance_of.get(chunk_id), bm25_of.get(chunk_id)) for chunk_id, score in best]
+
+    def _hits(self, bests: List[List[tuple]]) -> List[List[dict]]:
+        "Attach texts and metadata, looked up in one call for all queries"
+        texts, metadata = self.vector_store.get_chunks([entry[0] for best in bests for entry in best])
+        chunks = iter(zip(texts, metadata))
+        results = []
+        for best in bests:
+            hits = []
+            for (chunk_id, score, distance, bm25_score), (text, meta) in zip(best, chunks):
+                if text is None:
+                    continue  # compacted away between the search and the lookup
+                hits.append({
+                    "id": chunk_id,
+                    "score": score,
+                    "text": text,
+                    "metadata": meta,
+                    "vector_distance": distance,
+                    "bm25_score": bm25_score,
+                })
+            results.append(hits)
+        return results
+
+    def retrieve(self, query_emb: np.ndarray, query_text: str, top_k: int = 5,
+                 allowed: Optional[np.ndarray] = None) -> List[str]:
+        "Texts of the fused top_k hits"
+        return [hit["text"] for hit in self.search(query_emb, query_text, top_k=top_k, allowed=allowed)]
+
+    def retrieve_batch(self, query_embs: np.ndarray, query_texts: List[str], top_k: int = 5) -> List[List[str]]:
+        return [[hit["text"] for hit in hits] for hits in self.search_batch(query_embs, query_texts, top_k=top_k)]
 
 
 # -----------------------------------------------------------
@@ -86,27 +166,26 @@ class HybridRetriever:
 # -----------------------------------------------------------
 # if __name__ == "__main__":
 #     class MockVectorStore:
-#         def search(self, query_emb, top_k=3):
-#             return [
-#                 {"text": "Don Bradman was a famous cricketer"},
-#                 {"text": "He is known for his exceptional batting average"},
-#             ]
-
+#         chunks = {
+#             0: "Don Bradman was a famous cricketer",
+#             1: "He is known for his exceptional batting average",
+#             2: "Sir Donald Bradman is one of the greatest batsmen in history",
+#             3: "Bradman played for Australia",
+#         }
+#
+#         def search_ids(self, query_emb, top_k=3):
+#             return np.array([0, 1]), np.array([0.4, 0.9])
+#
+#         def get_chunks(self, ids):
+#             return [self.chunks[i] for i in ids], [{} for _ in ids]
+#
 #     class MockBM25Retriever:
-#         def retrieve(self, query_text, top_k=3):
-#             return (
-#                 [
-#                     {"text": "Sir Donald Bradman is one of the greatest batsmen in history"},
-#                     {"text": "Bradman played for Australia"},
-#                 ],
-#                 [0.9, 0.7],
-#             )
-
-#     vector_store = MockVectorStore()
-#     bm25_retriever = MockBM25Retriever()
-#     retriever = HybridRetriever(vector_store, bm25_retriever, alpha=0.6)
-
-#     results = retriever.retrieve(np.array([0.1, 0.2, 0.3]), "Why is Bradman famous?", top_k=3)
-#     print("\nFinal retrieved texts:")
+#         def retrieve_ids(self, query_text, top_k=3):
+#             return np.array([2, 3, 0]), np.array([0.9, 0.7, 0.2])
+#
+#     retriever = HybridRetriever(MockVectorStore(), MockBM25Retriever(), alpha=0.6, fusion="rrf")
+#
+#     results = retriever.search(np.array([0.1, 0.2, 0.3]), "Why is Bradman famous?", top_k=3)
+#     print("\nFinal retrieved hits:")
 #     for r in results:
-#         print("-", r)
+#         print("-", r["id"], round(r["score"], 4), r["text"])
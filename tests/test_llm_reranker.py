@@ -0,0 +1,195 @@
+"""
+LLMReranker against a local stand-in for an OpenAI-compatible server.
+
+Each document text says how the stand-in treats it: "llm=<score>" is the
+score the server returns, and "[slow]", "[garbled]" or "[skip]" make the
+server time out, answer with malformed JSON or leave that document out of
+its answer. "ce=<logit>" is what the fake cross-encoder fallback returns.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rerank.llm_reranker import LLMReranker
+
+
+class StandInLLM(BaseHTTPRequestHandler):
+    "Answers POST /v1/chat/completions with scores read from the documents in the prompt"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.prompts.append(request["messages"][0]["content"])
+        documents = json.loads(request["messages"][0]["content"].split("Documents:\n", 1)[1])
+        texts = " ".join(doc["text"] for doc in documents)
+        if "[slow]" in texts:
+            time.sleep(1.0)
+        if "[garbled]" in texts:
+            content = '[{"id": "0", "score": 0.9'
+        else:
+            scores = [{"id": doc["id"], "score": float(re.search(r"llm=(\S+)", doc["text"]).group(1))}
+                      for doc in documents if "[skip]" not in doc["text"]]
+            content = "```json\n" + json.dumps(scores) + "\n```"
+        body = json.dumps({
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCrossEncoder:
+    "Stands in for Reranker: rerank_with_metadata scores documents with their ce=<logit>"
+
+    def __init__(self):
+        self.calls = []
+
+    def rerank_with_metadata(self, query, documents, top_k=5):
+        self.calls.append([doc["id"] for doc in documents])
+        for doc in documents:
+            doc["score"] = float(re.search(r"ce=(\S+)", doc["text"]).group(1))
+        return sorted(documents, key=lambda d: d["score"], reverse=True)[:top_k]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInLLM)
+    httpd.daemon_threads = True
+    httpd.prompts = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def reranker_for(server, fallback=None, **kwargs) -> LLMReranker:
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return LLMReranker(fallback=fallback, provider="openai", model="stand-in", base_url=base_url, **kwargs)
+
+
+def docs(*texts):
+    return [{"id": i, "text": text} for i, text in enumerate(texts)]
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def test_ranks_by_llm_scores_across_batches(server):
+    fallback = FakeCrossEncoder()
+    reranker = reranker_for(server, fallback, batch_size=2)
+    documents = docs("a llm=0.2 ce=0", "b llm=0.9 ce=0", "c llm=0.5 ce=0", "d llm=0.7 ce=0", "e llm=0.1 ce=0")
+
+    ranked = reranker.rerank("query", documents)
+
+    assert [doc["id"] for doc in ranked] == [1, 3, 2, 0, 4]
+    assert [doc["score"] for doc in ranked] == [0.9, 0.7, 0.5, 0.2, 0.1]
+    assert all(doc["rerank_source"] == "llm" for doc in ranked)
+    assert len(server.prompts) == 3
+    assert fallback.calls == []
+    assert reranker.stats() == {"llm_batches": 3, "fallback_batches": 0}
+    assert "score" not in documents[0]  # the caller's dicts are left alone
+
+
+def test_timeout_falls_back_to_cross_encoder(server):
+    fallback = FakeCrossEncoder()
+    reranker = reranker_for(server, fallback, timeout=0.2)
+
+    started = time.perf_counter()
+    ranked = reranker.rerank("query", docs("a [slow] llm=0.9 ce=-1", "b llm=0.1 ce=2"))
+
+    assert time.perf_counter() - started < 0.9  # the deadline, not the server, ends the call
+    assert [doc["id"] for doc in ranked] == [1, 0]
+    assert [doc["score"] for doc in ranked] == pytest.approx([sigmoid(2), sigmoid(-1)])
+    assert all(doc["rerank_source"] == "fallback" for doc in ranked)
+    assert fallback.calls == [[0, 1]]
+    assert reranker.stats() == {"llm_batches": 0, "fallback_batches": 1}
+
+
+def test_malformed_json_falls_back_to_cross_encoder(server):
+    fallback = FakeCrossEncoder()
+    reranker = reranker_for(server, fallback)
+
+    ranked = reranker.rerank("query", docs("a [garbled] llm=0.9 ce=1", "b llm=0.1 ce=3"))
+
+    assert [doc["id"] for doc in ranked] == [1, 0]
+    assert all(doc["rerank_source"] == "fallback" for doc in ranked)
+    assert reranker.stats() == {"llm_batches": 0, "fallback_batches": 1}
+
+
+def test_skipped_document_falls_back_for_the_whole_batch(server):
+    fallback = FakeCrossEncoder()
+    reranker = reranker_for(server, fallback)
+
+    ranked = reranker.rerank("query", docs("a llm=0.9 ce=0", "b [skip] llm=0.8 ce=1"))
+
+    assert [doc["id"] for doc in ranked] == [1, 0]
+    assert [doc["score"] for doc in ranked] == pytest.approx([sigmoid(1), sigmoid(0)])
+    assert all(doc["rerank_source"] == "fallback" for doc in ranked)
+    assert fallback.calls == [[0, 1]]
+
+
+def test_failed_batches_merge_with_llm_batches(server):
+    fallback = FakeCrossEncoder()
+    reranker = reranker_for(server, fallback, batch_size=2, timeout=0.2)
+    documents = docs(
+        "a llm=0.3 ce=0", "b llm=0.6 ce=0",                # scored by the LLM
+        "c [garbled] llm=0 ce=3", "d llm=0 ce=-3",         # malformed JSON
+        "e [slow] llm=0 ce=0.5", "f llm=0 ce=-0.2",        # timed out
+    )
+
+    ranked = asyncio.run(reranker.arerank("query", documents, top_k=4))
+
+    assert [(doc["id"], doc["rerank_source"]) for doc in ranked] == [
+        (2, "fallback"), (4, "fallback"), (1, "llm"), (5, "fallback")]
+    assert ranked[0]["score"] == pytest.approx(sigmoid(3))
+    assert sorted(fallback.calls) == [[2, 3], [4, 5]]
+    assert reranker.stats() == {"llm_batches": 1, "fallback_batches": 2}
+
+
+def test_without_fallback_failed_documents_keep_their_order(server):
+    reranker = reranker_for(server, batch_size=2)
+
+    ranked = reranker.rerank("query", docs("a [garbled] llm=0", "b llm=0", "c llm=0.4", "d llm=0.2"))
+
+    assert [(doc["id"], doc["score"]) for doc in ranked] == [(2, 0.4), (3, 0.2), (0, 0.0), (1, 0.0)]
+    assert [doc["rerank_source"] for doc in ranked] == ["llm", "llm", "fallback", "fallback"]
+
+
+def test_concurrency_is_bounded(server):
+    reranker = reranker_for(server, batch_size=1, max_concurrency=2, timeout=5.0)
+    in_flight, peak = 0, 0
+    complete = reranker._complete
+
+    async def counting(prompt):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            return await complete(prompt)
+        finally:
+            in_flight -= 1
+    reranker._complete = counting
+
+    ranked = reranker.rerank("query", docs(*(f"{i} llm=0.{i}" for i in range(6))))
+
+    assert [doc["id"] for doc in ranked] == [5, 4, 3, 2, 1, 0]
+    assert peak == 2
@@ -0,0 +1,212 @@
+import bisect
+import os
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# One record per chunk: its document and the UTF-8 byte range within that document's text
+CHUNK_DTYPE = np.dtype([("doc", np.int64), ("start", np.int64), ("end", np.int64)])
+
+
+class _Part:
+    """
+    One persisted registry file set: <path>.bin holds the document texts,
+    <path>.docs the n + 1 int64 document offsets into it and <path>.spans the
+    chunk records (all memory-mapped). Text columns written before the
+    registry existed (<path>.bin/.off) load as one document per chunk.
+    """
+
+    def __init__(self, path: str):
+        self.blob = b""
+        if os.path.getsize(path + ".bin") > 0:
+            self.blob = np.memmap(path + ".bin", dtype=np.uint8, mode="r")
+        if os.path.exists(path + ".spans"):
+            self.docs = np.load(path + ".docs", mmap_mode="r")
+            self.records = np.load(path + ".spans", mmap_mode="r")
+            self.count = len(self.records)
+        else:
+            self.docs = np.load(path + ".off", mmap_mode="r")
+            self.records = None
+            self.count = len(self.docs) - 1
+
+    def span(self, i: int) -> Tuple[int, int, int]:
+        "(document, absolute start, absolute end) of local chunk i"
+        if self.records is None:
+            return i, int(self.docs[i]), int(self.docs[i + 1])
+        doc, start, end = self.records[i]
+        base = int(self.docs[doc])
+        return int(doc), base + int(start), base + int(end)
+
+
+class ChunkRegistry:
+    def __init__(self, paths: Sequence[str] = (), overlap: int = 0):
+        """
+        Chunk texts stored once per document. Each document's cleaned text is
+        kept as one UTF-8 blob (memory-mapped once persisted) and a chunk is a
+        compact (doc, start, end) record into it, so the overlap between
+        consecutive chunks is stored once instead of in both chunks. Texts are
+        decoded lazily, one chunk per access; the registry is list-like over
+        row numbers, like the text column it replaces.
+
+        Args:
+            paths: Persisted parts, in row order (one per segment).
+            overlap: Characters consecutive chunks of a document share (the
+                     chunker's overlap); a chunk whose first `overlap` characters
+                     match the end of the previous chunk of its document
+                     reuses them. Anything else starts a new document.
+        """
+        self.overlap = overlap
+        self._parts = [_Part(path) for path in paths]
+        self._starts = [0]
+        self._docs_before = [0]  # global document numbering across parts
+        for part in self._parts:
+            self._starts.append(self._starts[-1] + part.count)
+            self._docs_before.append(self._docs_before[-1] + len(part.docs) - 1)
+        # In-memory tail for chunks added since the last persist
+        self._blob = bytearray()
+        self._doc_offsets: List[int] = [0]
+        self._records = np.empty(0, dtype=CHUNK_DTYPE)
+        self._size = 0
+        self._last_key: Any = None
+
+    @property
+    def _mapped_len(self) -> int:
+        return self._starts[-1]
+
+    def __len__(self) -> int:
+        return self._mapped_len + self._size
+
+    def _span(self, i: int) -> Tuple[int, Any, int, int]:
+        "(source part index, document, absolute start, absolute end) of row i"
+        if i >= self._mapped_len:
+            doc, start, end = self._records[i - self._mapped_len]
+            base = self._doc_offsets[doc]
+            return len(self._parts), int(doc), base + int(start), base + int(end)
+        part = bisect.bisect_right(self._starts, i) - 1
+        return (part, *self._parts[part].span(i - self._starts[part]))
+
+    def _bytes(self, source: int, start: int, end: int) -> bytes:
+        blob = self._blob if source == len(self._parts) else self._parts[source].blob
+        return bytes(blob[start:end])
+
+    def raw(self, i: int) -> bytes:
+        source, _, start, end = self._span(i)
+        return self._bytes(source, start, end)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("registry index out of range")
+        return self.raw(i).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def stats(self) -> dict:
+        "Chunk and document counts and the bytes of text actually stored"
+        text_bytes = sum(len(part.blob) for part in self._parts) + len(self._blob)
+        tail_docs = len(self._doc_offsets) if self._size else 0
+        return {"chunks": len(self), "documents": self._docs_before[-1] + tail_docs, "text_bytes": text_bytes}
+
+    # -----------------------------------------------------------
+    # Adding chunks
+    # -----------------------------------------------------------
+    def _append_record(self, doc: int, start: int, end: int):
+        if self._size == len(self._records):
+            grown = np.empty(max(2 * len(self._records), 1024), dtype=CHUNK_DTYPE)
+            grown[:self._size] = self._records[:self._size]
+            self._records = grown
+        self._records[self._size] = (doc, start, end)
+        self._size += 1
+
+    def extend(self, texts: Iterable[str], documents: Optional[Iterable[Any]] = None):
+        """
+        Append chunks in order. documents gives a key per chunk (e.g. its
+        source); a chunk continues the previous one's document when the keys
+        match and its leading overlap is the stored tail of that document.
+        Without keys every chunk is its own document.
+        """
+        texts = list(texts)
+        keys = [None] * len(texts) if documents is None else list(documents)
+        for text, key in zip(texts, keys):
+            data = text.encode("utf-8")
+            shared = 0
+            if key is not None and key == self._last_key and self.overlap and self._size:
+                prefix = text[:self.overlap].encode("utf-8")
+                if prefix and self._blob.endswith(prefix):
+                    shared = len(prefix)
+            if not shared and self._size:
+                self._doc_offsets.append(len(self._blob))
+            doc = len(self._doc_offsets) - 1
+            base = self._doc_offsets[doc]
+            start = len(self._blob) - shared - base
+            self._blob += data[shared:]
+            self._append_record(doc, start, start + len(data))
+            self._last_key = key
+
+    def append(self, text: str, document: Any = None):
+        self.extend([text], None if document is None else [document])
+
+    # -----------------------------------------------------------
+    # Persistence
+    # -----------------------------------------------------------
+    def _copy_rows(self, rows: Iterable[int], write):
+        """
+        Re-pack the given rows: runs of rows sharing bytes of one source
+        document stay one document, everything else is dropped. write(bytes)
+        receives the packed text; returns (document offsets, records).
+        """
+        offsets = [0]
+        records = []
+        written = 0
+        current = None  # (source, doc, source start of the output document, source end written so far)
+        for i in rows:
+            source, doc, start, end = self._span(int(i))
+            if current is not None and current[:2] == (source, doc) and current[2] <= start <= current[3]:
+                _, _, begin, done = current
+                if end > done:
+                    data = self._bytes(source, done, end)
+                    write(data)
+                    written += len(data)
+                    done = end
+                current = (source, doc, begin, done)
+            else:
+                if current is not None:
+                    offsets.append(written)
+                data = self._bytes(source, start, end)
+                write(data)
+                written += len(data)
+                current = (source, doc, start, end)
+            records.append((len(offsets) - 1, start - current[2], end - current[2]))
+        if records:
+            offsets.append(written)
+        return np.asarray(offsets, dtype=np.int64), np.asarray(records, dtype=CHUNK_DTYPE)
+
+    def write(self, path: str, rows: Iterable[int]) -> int:
+        "Persist the given rows as a registry part at <path>; returns the chunk count"
+        with open(path + ".bin", "wb") as f:
+            offsets, records = self._copy_rows(rows, f.write)
+        with open(path + ".docs", "wb") as f:
+            np.save(f, offsets)
+        with open(path + ".spans", "wb") as f:
+            np.save(f, records)
+        return len(records)
+
+    def carry_tail(self, source: "ChunkRegistry", start: int):
+        """
+        Take over source's rows from start on (the ones not yet persisted) as
+        this registry's in-memory tail, keeping their shared overlaps. Used on
+        a freshly loaded registry, whose tail is still empty.
+        """
+        blob = bytearray()
+        offsets, records = source._copy_rows(range(start, len(source)), blob.extend)
+        if not len(records):
+            return
+        self._blob = blob
+        self._doc_offsets = offsets[:-1].tolist()
+        self._records = records.copy()
+        self._size = len(records)
+        self._last_key = source._last_key
@@ -0,0 +1,101 @@
+import bisect
+import json
+import os
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
+import numpy as np
+
+
+def write_column(path: str, values: Iterable[bytes]) -> int:
+    """
+    Write encoded values as an offset-indexed column:
+    <path>.bin holds the concatenated bytes and <path>.off the n + 1 int64
+    offsets (as .npy, so it can be memory-mapped). Returns the item count.
+    """
+    offsets = [0]
+    with open(path + ".bin", "wb") as f:
+        for value in values:
+            f.write(value)
+            offsets.append(offsets[-1] + len(value))
+    with open(path + ".off", "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+    return len(offsets) - 1
+
+
+class MappedColumn:
+    """
+    List-like column of values whose persisted part is memory-mapped and
+    decoded lazily, one item per access. The persisted part may span several
+    column files (one per segment). Values appended after loading live in an
+    in-memory tail until they are persisted and remapped.
+    """
+
+    def __init__(self, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any], paths: Sequence[str] = ()):
+        self.encode = encode
+        self.decode = decode
+        self._parts = []
+        self._starts = [0]
+        self._tail: List[Any] = []
+        for path in paths:
+            blob = b""
+            if os.path.getsize(path + ".bin") > 0:
+                blob = np.memmap(path + ".bin", dtype=np.uint8, mode="r")
+            offsets = np.load(path + ".off", mmap_mode="r")
+            self._parts.append((blob, offsets))
+            self._starts.append(self._starts[-1] + len(offsets) - 1)
+
+    @property
+    def _mapped_len(self) -> int:
+        return self._starts[-1]
+
+    def __len__(self) -> int:
+        return self._mapped_len + len(self._tail)
+
+    def _raw(self, i: int) -> bytes:
+        part = bisect.bisect_right(self._starts, i) - 1
+        blob, offsets = self._parts[part]
+        local = i - self._starts[part]
+        start, end = int(offsets[local]), int(offsets[local + 1])
+        return bytes(blob[start:end])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("column index out of range")
+        if i >= self._mapped_len:
+            return self._tail[i - self._mapped_len]
+        return self.decode(self._raw(i))
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value: Any):
+        self._tail.append(value)
+
+    def extend(self, values: Iterable[Any]):
+        self._tail.extend(values)
+
+    def iter_encoded(self, start: int = 0, stop: Optional[int] = None,
+                     rows: Optional[Iterable[int]] = None) -> Iterator[bytes]:
+        """
+        Encoded values in [start, stop) (or at the given rows) for persistence;
+        mapped items are copied without decoding.
+        """
+        if rows is None:
+            rows = range(start, len(self) if stop is None else stop)
+        for i in rows:
+            if i < self._mapped_len:
+                yield self._raw(i)
+            else:
+                yield self.encode(self._tail[i - self._mapped_len])
+
+
+def json_column(paths: Sequence[str] = ()) -> MappedColumn:
+    return MappedColumn(
+        lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"),
+        lambda b: json.loads(b),
+        paths,
+    )
@@ -1,51 +1,889 @@
 import faiss
+import json
 import numpy as np
 import pickle
-from typing import List, Tuple
+import threading
+import time
+from typing import List, Optional, Tuple
 from .base_store import BaseStore
+from .chunk_registry import ChunkRegistry
+from .column_store import json_column
+from .segment_store import SegmentLog
 import os
 
+# Zero-copy mmap of the index file when this faiss build supports it
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+# Filtered searches over at most this many chunks are brute-forced exactly:
+# cheaper than a selector-restricted index walk, and HNSW/IVF recall drops
+# when the filter is very selective
+EXACT_FILTER_ROWS = 4096
+
+# Vector storage modes: the faiss encoding replacing "Flat" in index_spec, and how many
+# candidates per requested hit are rescored exactly against the float32 vectors
+STORAGE_MODES = {
+    "float32": ("Flat", 1),
+    "float16": ("SQfp16", 2),
+    "int8": ("SQ8", 4),
+    "binary": ("LSHt", 16),  # one sign bit per dimension (median thresholds), Hamming distance
+}
+
+# Quantizers without IVF lists (SQ8 ranges, LSH thresholds) train on at least this many vectors
+MIN_QUANTIZER_TRAIN_ROWS = 1000
+
+# Files of the previous single-snapshot formats, removed once rewritten as segments
+OLD_FORMAT_SUFFIXES = ['.index', '.texts.bin', '.texts.off', '.meta.bin', '.meta.off', '_data.pkl']
+
+
 class FaissStore(BaseStore):
-    def __init__(self, dimension: int):
+    def __init__(self, dimension: int, index_spec: str = "Flat", nprobe: int = 16, ef_search: int = 64,
+                 migrate_threshold: int = 0, max_train_size: int = 100000, max_segments: int = 8,
+                 max_deleted_ratio: float = 0.2, chunk_overlap: int = 0, storage: str = "float32",
+                 rescore_factor: Optional[int] = None):
+        """
+        Args:
+            dimension: Embedding dimension.
+            index_spec: faiss index_factory string for the target index,
+                        e.g. "Flat", "IVF1024,Flat", "IVF1024,PQ16" or "HNSW32".
+            nprobe: IVF lists visited per query (recall vs latency).
+            ef_search: HNSW candidate list size per query (recall vs latency).
+            migrate_threshold: Vectors are kept in an exact flat index until at least
+                        this many (and enough to train index_spec) have accumulated,
+                        then migrated to index_spec by the next save or compaction
+                        (never inside add(), which must stay cheap).
+            max_train_size: Cap on the sample used to train IVF/PQ indexes.
+            max_segments: Saved segments allowed before compaction is due.
+            max_deleted_ratio: Fraction of tombstoned chunks that makes compaction due.
+            chunk_overlap: The chunker's overlap; consecutive chunks of a source
+                        share it in the chunk registry instead of storing it twice.
+            storage: How the index holds vectors: "float32", "float16" / "int8"
+                        (scalar quantization, 2x / 4x smaller) or "binary" (one
+                        bit per dimension searched by Hamming distance, 32x
+                        smaller; index_spec must be "Flat"). Quantized modes fetch
+                        a shortlist of rescore_factor * top_k candidates and
+                        rescore it exactly against the float32 vectors, which stay
+                        in the memory-mapped segment files instead of in RAM.
+            rescore_factor: Shortlist size per requested hit (default per mode).
+        """
         self.dimension = dimension
-        self.index = faiss.IndexFlatL2(dimension)
-        self.texts = []
-        self.metadata = []
+        self.index_spec = index_spec
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.migrate_threshold = migrate_threshold
+        self.max_train_size = max_train_size
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.chunk_overlap = chunk_overlap
+        self.storage = storage
+        self.rescore_factor = rescore_factor
+        self._factory_spec()  # validates the storage / index_spec combination
+        # (main, delta): main may be a read-only mmap of the last snapshot, in
+        # which case rows added since then go to an in-memory flat delta index.
+        # Kept as one tuple so a compaction swap is atomic for readers.
+        self._indexes = (faiss.IndexFlatL2(dimension), None)
+        self._index_mapped = False
+        # Chunk texts: one blob per document, chunks are (doc, start, end) records into it
+        self.texts = ChunkRegistry(overlap=chunk_overlap)
+        self.metadata = json_column()
+        self._unsaved: List[np.ndarray] = []  # vectors added since the last save
+        self._persisted = 0  # rows already written to disk
+        # float32 vectors of the persisted rows, memory-mapped per segment (for exact rescoring)
+        self._segment_vectors: List[np.ndarray] = []
+        self._log: Optional[SegmentLog] = None
+        self._segment_count = 0
+        # Stable chunk ids: rows loaded from disk map through _base_ids (which
+        # has gaps after compaction), rows added since are numbered contiguously
+        self._base_ids = np.empty(0, dtype=np.int64)
+        self._tail_first_id = 0
+        self._next_id = 0
+        # Tombstones: deleted ids are skipped by searches until compaction drops them
+        self._deleted_ids = set()
+        self._tombstone_version = 0
+        self._tombstones_saved = 0
+        self._dead_filter_cache = None
+        self._write_lock = threading.Lock()  # add/delete vs. snapshotting/adopting state
+        self._persist_lock = threading.Lock()  # one save/compaction at a time
+        # Bumped before and after a compaction swaps in renumbered rows (odd while
+        # swapping), so lock-free readers can tell a row -> id mapping went stale
+        self._generation = 0
+
+    @property
+    def index(self):
+        return self._indexes[0]
+
+    @staticmethod
+    def exists(file_path: str) -> bool:
+        "True if a store in any supported format has been saved at file_path"
+        return os.path.exists(file_path + '.json') or os.path.exists(file_path + '.index')
+
+    @staticmethod
+    def stored_version(file_path: str) -> Optional[int]:
+        "Version of the segment store saved at file_path; it changes with every save and compaction"
+        manifest = SegmentLog(file_path).read_manifest()
+        return manifest['next_segment'] if manifest else None
+
+    @staticmethod
+    def recover_files(file_path: str):
+        """
+        Remove unfinished segment writes left by a crashed writer. Only safe
+        while no other process may be writing to file_path.
+        """
+        log = SegmentLog(file_path)
+        manifest = log.read_manifest()
+        if manifest is not None:
+            log.recover(manifest)
+
+    # -----------------------------------------------------------
+    # Chunk ids and tombstones
+    # -----------------------------------------------------------
+    def ids_of(self, rows) -> np.ndarray:
+        "Stable chunk ids of the given rows"
+        rows = np.asarray(rows, dtype=np.int64)
+        n_base = len(self._base_ids)
+        ids = self._tail_first_id + rows - n_base
+        in_base = rows < n_base
+        ids[in_base] = self._base_ids[rows[in_base]]
+        return ids
+
+    def rows_of(self, ids) -> np.ndarray:
+        "Current rows of the given chunk ids (-1 for unknown or compacted-away ids)"
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        n_base = len(self._base_ids)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+
+        in_tail = ids >= self._tail_first_id
+        tail_rows = n_base + ids[in_tail] - self._tail_first_id
+        rows[in_tail] = np.where(tail_rows < len(self.texts), tail_rows, -1)
+
+        base_ids = ids[~in_tail]
+        positions = np.searchsorted(self._base_ids, base_ids)
+        found = positions < n_base
+        found[found] = self._base_ids[positions[found]] == base_ids[found]
+        rows[~in_tail] = np.where(found, positions, -1)
+        return rows
+
+    def delete(self, ids) -> int:
+        """
+        Tombstone chunks by id. They disappear from searches immediately and are
+        physically removed by the next compaction. Returns how many were deleted.
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        with self._write_lock:
+            rows = self.rows_of(ids)
+            new_ids = {int(i) for i in ids[rows >= 0]} - self._deleted_ids
+            if new_ids:
+                self._deleted_ids |= new_ids
+                self._tombstone_version += 1
+        return len(new_ids)
+
+    @property
+    def deleted_count(self) -> int:
+        return len(self._deleted_ids)
+
+    @property
+    def deleted_ids(self) -> frozenset:
+        return frozenset(self._deleted_ids)
+
+    @property
+    def next_id(self) -> int:
+        "Id the next added chunk will get"
+        return self._next_id
+
+    def _dead_filters(self, main):
+        """
+        Search parameters that exclude tombstoned rows of the main index (via a
+        bitmap IDSelector), the tombstoned main rows to drop after searching
+        when the index takes no selector (binary codes), and the tombstoned
+        rows of the delta index. Cached until the tombstones or the main index change.
+        """
+        key = (id(main), self._tombstone_version)
+        cache = self._dead_filter_cache
+        if cache is not None and cache[0] == key:
+            return cache[1:]
+
+        with self._write_lock:
+            dead_rows = self.rows_of(sorted(self._deleted_ids))
+        dead_rows = np.sort(dead_rows[dead_rows >= 0])
+        main_dead = dead_rows[dead_rows < main.ntotal]
+        delta_dead = dead_rows[dead_rows >= main.ntotal]
+
+        params = None
+        if len(main_dead) and self._takes_selector(main):
+            bitmap = np.zeros((int(main_dead[-1]) >> 3) + 1, dtype=np.uint8)
+            np.bitwise_or.at(bitmap, main_dead >> 3, (1 << (main_dead & 7)).astype(np.uint8))
+            selector = faiss.IDSelectorNot(faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)))
+            params = self._search_params(main, selector)
+            # faiss only keeps raw pointers; hold the Python objects alive with the params
+            params.referenced_objects = [bitmap, selector]
+            main_dead = main_dead[:0]
+
+        self._dead_filter_cache = (key, params, main_dead, delta_dead)
+        return params, main_dead, delta_dead
+
+    @staticmethod
+    def _takes_selector(index) -> bool:
+        "False for indexes whose search ignores SearchParameters (binary LSH codes)"
+        return not isinstance(index, faiss.IndexLSH)
+
+    def _search_params(self, index, selector):
+        if faiss.try_extract_index_ivf(index) is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    # -----------------------------------------------------------
+    # Index type management
+    # -----------------------------------------------------------
+    def _factory_spec(self) -> str:
+        "index_factory string of the target index: index_spec with the storage mode's encoding"
+        if self.storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {self.storage!r}; expected one of {sorted(STORAGE_MODES)}")
+        encoding = STORAGE_MODES[self.storage][0]
+        if self.storage == "float32":
+            return self.index_spec
+        if "PQ" in self.index_spec or "SQ" in self.index_spec or "LSH" in self.index_spec:
+            raise ValueError(f"index_spec {self.index_spec!r} already compresses vectors; use storage='float32'")
+        if self.index_spec == "Flat":
+            return encoding
+        if self.storage == "binary":
+            raise ValueError("storage='binary' needs index_spec='Flat' (Hamming search has no IVF/HNSW variant)")
+        if self.index_spec.endswith(",Flat"):
+            return self.index_spec[:-len("Flat")] + encoding
+        if self.index_spec.startswith("HNSW") and "," not in self.index_spec:
+            return f"{self.index_spec}_{encoding}"
+        raise ValueError(f"Cannot combine index_spec {self.index_spec!r} with storage {self.storage!r}")
+
+    @property
+    def is_migrated(self) -> bool:
+        "True once the store runs on index_spec rather than the initial flat index"
+        return self._factory_spec() == "Flat" or not isinstance(self.index, faiss.IndexFlat)
+
+    def _min_train_size(self) -> int:
+        "Number of vectors needed before index_spec can be trained sensibly"
+        probe = faiss.index_factory(self.dimension, self._factory_spec())
+        if probe.is_trained:
+            return 0
+        needed = MIN_QUANTIZER_TRAIN_ROWS if self.storage != "float32" else 0
+        ivf = faiss.try_extract_index_ivf(probe)
+        if ivf is not None:
+            needed = max(needed, 39 * ivf.nlist)  # faiss warns below 39 points per centroid
+        if "PQ" in self.index_spec:
+            needed = max(needed, 39 * 256)
+        return needed
+
+    def _migration_due(self, rows: int) -> bool:
+        return not self.is_migrated and rows >= max(self.migrate_threshold, self._min_train_size())
+
+    def _apply_search_params(self, index=None):
+        index = self.index if index is None else index
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        "Change search-time knobs of the current index"
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        self._apply_search_params()
+
+    def _build_index(self, vectors: np.ndarray):
+        "Train (if needed) and fill a fresh index_spec index"
+        index = faiss.index_factory(self.dimension, self._factory_spec())
+        if not index.is_trained:
+            sample = vectors
+            if len(vectors) > self.max_train_size:
+                rng = np.random.default_rng(0)
+                sample = vectors[np.sort(rng.choice(len(vectors), self.max_train_size, replace=False))]
+            index.train(np.ascontiguousarray(sample))
+        index.add(np.ascontiguousarray(vectors))
+        self._apply_search_params(index)
+        return index
+
+    def _empty_like(self, index):
+        "An empty index with the same structure (and training) as index"
+        if isinstance(index, faiss.IndexFlat):
+            return faiss.IndexFlatL2(self.dimension)
+        # Serializing copies a memory-mapped index into owned memory first
+        empty = faiss.deserialize_index(faiss.serialize_index(index))
+        empty.reset()
+        self._apply_search_params(empty)
+        return empty
+
+    # -----------------------------------------------------------
+    # Store API
+    # -----------------------------------------------------------
+    def add(self, texts: List[str], embeddings: List[List[float]], metadata: List[dict]) -> np.ndarray:
+        "Add chunks and return their stable chunk ids"
+        # No copy when the embedder already returns a contiguous float32 array
+        vectors = np.ascontiguousarray(embeddings, dtype='float32')
+        with self._write_lock:
+            main, delta = self._indexes
+            if self._index_mapped:
+                if delta is None:
+                    delta = faiss.IndexFlatL2(self.dimension)
+                delta.add(vectors)
+                self._indexes = (main, delta)
+            else:
+                main.add(vectors)
+            self.texts.extend(texts, [meta.get('source') if meta else None for meta in metadata])
+            self.metadata.extend(metadata)
+            self._unsaved.append(vectors)
+            ids = np.arange(self._next_id, self._next_id + len(vectors), dtype=np.int64)
+            self._next_id += len(vectors)
+        return ids
+
+    def _search(self, queries: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (distances, rows) of the top_k live rows. With quantized storage the
+        index only supplies a shortlist, reordered by exact float32 distances.
+        """
+        if self.storage == "float32" or not self.is_migrated:
+            return self._search_index(queries, top_k, allowed)
+        factor = self.rescore_factor or STORAGE_MODES[self.storage][1]
+        _, rows = self._search_index(queries, top_k * factor, allowed, exact_float=True)
+        return self._rescore(queries, rows, top_k)
+
+    @staticmethod
+    def _merge(distances: np.ndarray, indices: np.ndarray, top_k: int,
+               keep_all: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best top_k per query of concatenated (distances, rows) results; -1 rows
+        sort last. keep_all returns every candidate unsorted: shortlists from
+        different indexes (Hamming codes vs. float delta) aren't comparable
+        until rescored.
+        """
+        if keep_all:
+            return distances, indices
+        distances = np.where(indices >= 0, distances, np.inf)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :top_k]
+        return np.take_along_axis(distances, order, 1), np.take_along_axis(indices, order, 1)
+
+    def _search_dropping(self, index, queries: np.ndarray, top_k: int, dropped: np.ndarray, keep: bool = False):
+        """
+        Search an index that takes no selector: over-fetch and mask out the
+        given rows (or, with keep, every row but them).
+        """
+        fetch = top_k + len(dropped) if not keep else top_k * -(-index.ntotal // max(len(dropped), 1))
+        distances, indices = index.search(queries, max(min(fetch, index.ntotal), 1))
+        indices[np.isin(indices, dropped, invert=keep) & (indices >= 0)] = -1
+        return self._merge(distances, indices, top_k)
+
+    def _search_index(self, queries: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None,
+                      exact_float: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        "Search main and delta indexes and merge them into one (distances, rows) result"
+        if allowed is not None:
+            return self._search_filtered(queries, top_k, allowed, exact_float)
+        main, delta = self._indexes
+        params, main_dead, delta_dead = self._dead_filters(main) if self._deleted_ids else (None, (), ())
+        if params is not None:
+            distances, indices = main.search(queries, top_k, params=params)
+        elif len(main_dead):
+            distances, indices = self._search_dropping(main, queries, top_k, main_dead)
+        else:
+            distances, indices = main.search(queries, top_k)
+        if delta is None or delta.ntotal == 0:
+            return distances, indices
+
+        # The delta is a small flat index: over-fetch and drop tombstoned rows
+        delta_distances, delta_indices = delta.search(queries, min(top_k + len(delta_dead), delta.ntotal))
+        delta_indices = np.where(delta_indices >= 0, delta_indices + main.ntotal, -1)
+        if len(delta_dead):
+            delta_indices[np.isin(delta_indices, delta_dead)] = -1
+        return self._merge(np.hstack([distances, delta_distances]), np.hstack([indices, delta_indices]), top_k,
+                           keep_all=exact_float)
 
-    def add(self, texts: List[str], embeddings: List[List[float]], metadata: List[dict]):
-        vectors = np.array(embeddings).astype('float32')
-        self.index.add(vectors)
-        self.texts.extend(texts)
-        self.metadata.extend(metadata)
+    def _allowed_rows(self, allowed: np.ndarray) -> np.ndarray:
+        "Sorted rows of the live chunks whose ids are set in the allowed bitmap"
+        ids = np.flatnonzero(allowed)
+        deleted = self._deleted_ids
+        if deleted:
+            ids = ids[~np.isin(ids, np.fromiter(deleted, dtype=np.int64, count=len(deleted)))]
+        rows = self.rows_of(ids)
+        return np.sort(rows[rows >= 0])
 
+    @staticmethod
+    def _exact_knn(queries: np.ndarray, vectors: np.ndarray, rows: np.ndarray, top_k: int):
+        "Squared-L2 top_k of queries against vectors, padded with (inf, -1) like a faiss search"
+        distances = ((queries ** 2).sum(1)[:, None] - 2.0 * queries @ vectors.T + (vectors ** 2).sum(1)[None, :])
+        np.maximum(distances, 0.0, out=distances)
+        k = min(top_k, len(rows))
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        out_distances = np.full((len(queries), top_k), np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        out_distances[:, :k] = np.take_along_axis(distances, order, 1)
+        out_rows[:, :k] = rows[order]
+        return out_distances, out_rows
+
+    def _reconstruct_rows(self, index, rows: np.ndarray) -> Optional[np.ndarray]:
+        "Stored vectors of the given rows, or None if the index cannot reconstruct them"
+        if not len(rows):
+            return np.empty((0, self.dimension), dtype='float32')
+        try:
+            return index.reconstruct_batch(rows)
+        except RuntimeError:
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap:
+                return None
+        # IVF needs a row -> (list, offset) map; built once per index, on first use
+        with self._write_lock:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+        return index.reconstruct_batch(rows)
+
+    def _search_filtered(self, queries: np.ndarray, top_k: int, allowed: np.ndarray,
+                         exact_float: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search restricted to the chunk ids set in the allowed bitmap. Small
+        allowed sets are scored exactly from reconstructed vectors (the float32
+        ones with exact_float); larger ones go through the index with an
+        IDSelectorBitmap, so top_k is taken over allowed chunks only either way.
+        """
+        main, delta = self._indexes
+        rows = self._allowed_rows(allowed)
+        main_rows, delta_rows = rows[rows < main.ntotal], rows[rows >= main.ntotal]
+
+        parts = []
+        exact_main = None
+        if len(main_rows) <= EXACT_FILTER_ROWS:
+            exact_main = self._float_vectors(main_rows) if exact_float else self._reconstruct_rows(main, main_rows)
+        if exact_main is None and not self._takes_selector(main):
+            parts.append(self._search_dropping(main, queries, top_k, main_rows, keep=True))
+            exact_vectors, exact_rows = [], delta_rows
+        elif exact_main is None:
+            bitmap = np.zeros((main.ntotal >> 3) + 1, dtype=np.uint8)
+            np.bitwise_or.at(bitmap, main_rows >> 3, (1 << (main_rows & 7)).astype(np.uint8))
+            selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            parts.append(main.search(queries, top_k, params=self._search_params(main, selector)))
+            exact_vectors, exact_rows = [], delta_rows
+        else:
+            exact_vectors, exact_rows = [exact_main], rows
+        if len(delta_rows):
+            exact_vectors.append(delta.reconstruct_batch(delta_rows - main.ntotal))
+        if len(exact_rows):
+            parts.append(self._exact_knn(queries, np.vstack(exact_vectors), exact_rows, top_k))
+
+        if not parts:
+            return (np.full((len(queries), top_k), np.inf, dtype=np.float32),
+                    np.full((len(queries), top_k), -1, dtype=np.int64))
+        return self._merge(np.hstack([d for d, _ in parts]), np.hstack([i for _, i in parts]), top_k,
+                           keep_all=exact_float)
+
+    def _float_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        float32 vectors of the given rows: persisted rows are read from the
+        memory-mapped segment files (only the touched pages load), newer rows
+        from the unsaved buffer.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._write_lock:
+            segments = list(self._segment_vectors)
+            persisted = self._persisted
+            unsaved = list(self._unsaved)
+        out = np.empty((len(rows), self.dimension), dtype=np.float32)
+        starts = np.cumsum([0] + [len(part) for part in segments])
+        if starts[-1] < persisted:
+            # Loaded from an older format without vector files: the index itself is float32
+            old = rows < persisted
+            out[old] = self._reconstruct_rows(self.index, rows[old])
+        else:
+            part_of = np.searchsorted(starts, rows, side='right') - 1
+            for part in np.unique(part_of[rows < persisted]):
+                sel = (part_of == part) & (rows < persisted)
+                out[sel] = segments[part][rows[sel] - starts[part]]
+        new = rows >= persisted
+        if new.any():
+            out[new] = np.concatenate(unsaved)[rows[new] - persisted]
+        return out
+
+    def _rescore(self, queries: np.ndarray, rows: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        "Reorder each query's shortlisted rows by exact squared-L2 distance to the float32 vectors"
+        candidates = np.unique(rows[rows >= 0])
+        vectors = self._float_vectors(candidates)
+        out_distances = np.full((len(queries), top_k), np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        for i, (query, shortlist) in enumerate(zip(queries, rows)):
+            shortlist = shortlist[shortlist >= 0]
+            if not len(shortlist):
+                continue
+            diffs = vectors[np.searchsorted(candidates, shortlist)] - query
+            distances = np.einsum('ij,ij->i', diffs, diffs)
+            order = np.argsort(distances, kind='stable')[:top_k]
+            out_distances[i, :len(order)] = distances[order]
+            out_rows[i, :len(order)] = shortlist[order]
+        return out_distances, out_rows
+
+    def _consistent(self, read):
+        """
+        Run read() against a single row numbering. Compaction renumbers rows
+        while searches run without a lock; a read that overlapped the swap is
+        retried, so rows from the old index never map through the new ids. A
+        read that failed because the swap happened under it (a row past the end
+        of the new texts, metadata or vectors) is retried the same way.
+        """
+        while True:
+            generation = self._generation
+            if generation % 2 == 0:
+                try:
+                    result = read()
+                except Exception:
+                    if self._generation == generation:
+                        raise
+                else:
+                    if self._generation == generation:
+                        return result
+            time.sleep(0)
 
     def search(self, query_embedding: List[float], top_k: int = 5) -> List[dict]:
-        query = np.array(query_embedding).astype('float32').reshape(1, -1)
-        distances, indices = self.index.search(query, top_k)
-        return [self.texts[i] for i in indices[0]], [self.metadata[i] for i in indices[0]]
-
-    def save(self, file_path: str): 
-        # os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        # print(f"🔍 Saving FAISS index to: {os.path.abspath(file_path + '.index')}")
-        # faiss.write_index(self.index, file_path + '.index')
-        # with open(file_path + "_chunks.txt", "w", encoding="utf-8") as f:
-        #     for chunk in self.texts_chunks:
-        #         f.write(chunk.replace("\n", " ") + "\n")
-
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        print(f"🔍 Saving FAISS index to: {os.path.abspath(file_path + '.index')}")
-        
-        # 1. Save the Faiss Index
-        faiss.write_index(self.index, file_path + '.index')
-        
-        # 2. Save texts AND metadata together using pickle (Recommended, and aligns with your 'load' method)
-        data = {'texts': self.texts, 'metadata': self.metadata}
-        with open(file_path + '_data.pkl', 'wb') as f:
-            pickle.dump(data, f)    
-
-    def load(self, file_path: str):
-        self.index = faiss.read_index(file_path + '.index')
-        with open(file_path + '_data.pkl', 'rb') as f:
-            data = pickle.load(f)
-            self.texts = data['texts']
-            self.metadata = data['metadata']             
\ No newline at end of file
+        query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+
+        def read():
+            distances, indices = self._search(query, top_k)
+            hits = [i for i in indices[0] if i >= 0]  # -1 pads results when fewer than top_k exist
+            return [self.texts[i] for i in hits], [self.metadata[i] for i in hits]
+        return self._consistent(read)
+
+    def search_ids(self, query_embedding: List[float], top_k: int = 5,
+                   allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Chunk ids and L2 distances of the nearest live chunks, nearest first.
+        allowed: optional boolean bitmap over chunk ids (see MetadataIndex) restricting the search.
+        """
+        query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+
+        def read():
+            distances, indices = self._search(query, top_k, allowed)
+            hits = indices[0] >= 0
+            return self.ids_of(indices[0][hits]), distances[0][hits]
+        return self._consistent(read)
+
+    def search_ids_batch(self, query_embeddings, top_k: int = 5,
+                         allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        "search_ids for many queries with one multi-row index search"
+        queries = np.ascontiguousarray(query_embeddings, dtype='float32').reshape(-1, self.dimension)
+
+        def read():
+            distances, indices = self._search(queries, top_k, allowed)
+            results = []
+            for row_distances, row_indices in zip(distances, indices):
+                hits = row_indices >= 0
+                results.append((self.ids_of(row_indices[hits]), row_distances[hits]))
+            return results
+        return self._consistent(read)
+
+    def get_chunks(self, ids) -> Tuple[List[str], List[dict]]:
+        "Texts and metadata of the given chunk ids (None for ids that no longer exist)"
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+
+        def read():
+            rows = self.rows_of(ids)
+            texts = [self.texts[i] if i >= 0 else None for i in rows]
+            metadata = [self.metadata[i] if i >= 0 else None for i in rows]
+            return texts, metadata
+        return self._consistent(read)
+
+    # -----------------------------------------------------------
+    # Persistence: append-only segments + compaction
+    # -----------------------------------------------------------
+    def save(self, file_path: str):
+        """
+        Append the rows added since the last save as a new segment, so the cost
+        is proportional to the upload, not the corpus. Pending tombstones are
+        written alongside. The first save to a path (or of a store loaded from
+        an older format) writes a full snapshot.
+        """
+        with self._persist_lock:
+            log = SegmentLog(file_path)
+            manifest = log.read_manifest()
+            if manifest is None or self._log is None or self._log.base != file_path:
+                print(f"🔍 Writing FAISS snapshot to: {os.path.abspath(log.segments_dir)}")
+                self._rewrite(log, manifest)
+                return
+
+            with self._write_lock:
+                parts = list(self._unsaved)
+                start = self._persisted
+                stop = start + sum(len(part) for part in parts)
+                next_id = self._next_id
+                texts = self.texts
+                tombstone_version = self._tombstone_version
+                tombstones = set(self._deleted_ids) if tombstone_version != self._tombstones_saved else None
+            if stop == start and tombstones is None:
+                return
+
+            if stop > start:
+                name = log.new_segment_name(manifest)
+                log.write_segment(name, self.dimension, parts, self.ids_of(np.arange(start, stop)),
+                                  lambda path: texts.write(path, range(start, stop)),
+                                  self.metadata.iter_encoded(start, stop))
+                manifest['segments'].append({'name': name, 'count': stop - start})
+                manifest['next_segment'] += 1
+                print(f"🔍 Appended FAISS segment {name} ({stop - start} chunks)")
+            old_tombstones = None
+            if tombstones is not None:
+                old_tombstones = manifest.get('tombstones')
+                manifest['tombstones'] = log.write_tombstones(manifest, tombstones)
+                manifest['next_segment'] += 1
+            manifest['count'] = stop
+            manifest['next_id'] = next_id
+            log.write_manifest(manifest)
+            if old_tombstones:
+                log.remove_segments([old_tombstones])
+
+            with self._write_lock:
+                if stop > start:
+                    self._segment_vectors.append(log.load_vectors(name))
+                del self._unsaved[:len(parts)]
+                self._persisted = stop
+                self._segment_count = len(manifest['segments'])
+                self._tombstones_saved = tombstone_version
+
+    def needs_compaction(self) -> bool:
+        "True when delta segments or tombstones piled up, or a deferred migration is due"
+        return self._log is not None and (
+            self._segment_count > self.max_segments
+            or len(self._deleted_ids) > self.max_deleted_ratio * max(len(self.texts), 1)
+            or self._migration_due(len(self.texts))
+        )
+
+    def compact(self):
+        "Merge all segments (and unsaved rows) into one snapshot segment, dropping deleted chunks"
+        with self._persist_lock:
+            if self._log is None:
+                return
+            print(f"🧱 Compacting {self._segment_count} FAISS segments, "
+                  f"dropping {len(self._deleted_ids)} deleted chunks")
+            self._rewrite(self._log, self._log.read_manifest())
+
+    def _rewrite(self, log: SegmentLog, manifest: Optional[dict]):
+        with self._write_lock:
+            stop = len(self.texts)
+            persisted = self._persisted
+            unsaved = list(self._unsaved)
+            main, delta = self._indexes
+            row_ids = self.ids_of(np.arange(stop))
+            next_id = self._next_id
+            texts = self.texts
+            deleted = set(self._deleted_ids)
+            dead_rows = self.rows_of(sorted(deleted))
+            if self._index_mapped:
+                delta_vectors = delta.reconstruct_n(0, delta.ntotal) if delta is not None else None
+                snapshot = None
+            else:
+                delta_vectors = None
+                snapshot = faiss.deserialize_index(faiss.serialize_index(main))
+
+        # Rows already on disk come from the segment files when this store owns
+        # them; stores loaded from an older format reconstruct them from the index
+        source_manifest = self._log.read_manifest() if self._log is not None else None
+        if source_manifest is not None:
+            vector_parts = [self._log.load_vectors(segment['name']) for segment in source_manifest['segments']]
+        elif persisted:
+            vector_parts = [self._reconstruct(main, 0, persisted)]
+        else:
+            vector_parts = []
+        vector_parts += unsaved
+
+        keep = np.ones(stop, dtype=bool)
+        keep[dead_rows[(dead_rows >= 0) & (dead_rows < stop)]] = False
+        keep_rows = np.flatnonzero(keep)
+        if len(keep_rows) < stop:
+            # Physically drop tombstoned rows; the index is refilled from the survivors
+            vectors = np.concatenate(vector_parts)[keep_rows] if vector_parts \
+                else np.empty((0, self.dimension), dtype=np.float32)
+            vector_parts = [vectors]
+            if not self._migration_due(len(keep_rows)):
+                snapshot = self._empty_like(main)
+                snapshot.add(vectors)
+        elif snapshot is None:
+            snapshot = faiss.deserialize_index(faiss.serialize_index(main))
+            if delta_vectors is not None and len(delta_vectors):
+                snapshot.add(delta_vectors)
+
+        if self._migration_due(len(keep_rows)):
+            snapshot = self._build_index(np.concatenate(vector_parts) if vector_parts
+                                         else np.empty((0, self.dimension), dtype=np.float32))
+            print(f"🔁 Migrated FAISS index to {self._factory_spec()} at {snapshot.ntotal} vectors.")
+
+        name = log.new_segment_name(manifest)
+        log.write_segment(name, self.dimension, vector_parts, row_ids[keep_rows],
+                          lambda path: texts.write(path, keep_rows), self.metadata.iter_encoded(rows=keep_rows),
+                          index=snapshot)
+        old_segments = [segment['name'] for segment in manifest['segments']] if manifest else []
+        if manifest and manifest.get('tombstones'):
+            old_segments.append(manifest['tombstones'])
+        log.write_manifest({
+            'count': len(keep_rows),
+            'dimension': self.dimension,
+            'index_spec': self.index_spec,
+            'nprobe': self.nprobe,
+            'ef_search': self.ef_search,
+            'migrate_threshold': self.migrate_threshold,
+            'storage': self.storage,
+            'rescore_factor': self.rescore_factor,
+            'segments': [{'name': name, 'count': len(keep_rows)}],
+            'next_segment': int(name.split('-')[1]) + 1,
+            'next_id': next_id,
+        })
+        log.remove_segments(old_segments)
+        for suffix in OLD_FORMAT_SUFFIXES:
+            if os.path.exists(log.base + suffix):
+                os.remove(log.base + suffix)
+
+        self._adopt(log, name, stop, len(unsaved), row_ids[keep_rows], deleted)
+
+    def _adopt(self, log: SegmentLog, name: str, stop: int, consumed: int, kept_ids: np.ndarray, dropped: set):
+        """
+        Switch to the freshly written snapshot. Rows added meanwhile move to the
+        delta; tombstones of the dropped rows are cleared, later ones are kept.
+        """
+        segment = log.segment_path(name)
+        snapshot = self._read_index(os.path.join(segment, 'index.faiss'))
+        with self._write_lock:
+            remaining = self._unsaved[consumed:]
+            delta = self._delta_for(snapshot, remaining)
+            texts = ChunkRegistry([os.path.join(segment, 'texts')], overlap=self.chunk_overlap)
+            texts.carry_tail(self.texts, stop)
+            metadata = json_column([os.path.join(segment, 'meta')])
+            metadata.extend(self.metadata[stop:])
+            tail_first_id = self._tail_first_id + stop - len(self._base_ids)
+            segment_vectors = [log.load_vectors(name)]
+
+            self._generation += 1
+            self._indexes = (snapshot, delta)
+            self._index_mapped = MMAP_FLAG is not None
+            self.texts = texts
+            self.metadata = metadata
+            self._base_ids = np.asarray(kept_ids, dtype=np.int64)
+            self._tail_first_id = tail_first_id
+            self._unsaved = remaining
+            self._segment_vectors = segment_vectors
+            self._persisted = len(kept_ids)
+            self._log = log
+            self._segment_count = 1
+            self._deleted_ids -= dropped
+            self._tombstone_version += 1
+            if not self._deleted_ids:
+                self._tombstones_saved = self._tombstone_version
+            self._generation += 1
+
+    def _delta_for(self, main, vector_parts: List[np.ndarray]):
+        "Put rows past the snapshot into a flat delta index (or main itself when it is not mapped)"
+        if not vector_parts:
+            return None
+        vectors = np.concatenate(vector_parts)
+        if MMAP_FLAG is None:
+            main.add(vectors)
+            return None
+        delta = faiss.IndexFlatL2(self.dimension)
+        delta.add(vectors)
+        return delta
+
+    def _read_index(self, path: str):
+        index = faiss.read_index(path, MMAP_FLAG) if MMAP_FLAG is not None else faiss.read_index(path)
+        self._apply_search_params(index)
+        return index
+
+    @staticmethod
+    def _reconstruct(index, start: int, stop: int) -> np.ndarray:
+        try:
+            return index.reconstruct_n(start, stop - start)
+        except RuntimeError:
+            # IVF indexes need a direct map before rows can be reconstructed
+            faiss.extract_index_ivf(index).make_direct_map()
+            return index.reconstruct_n(start, stop - start)
+
+    def load(self, file_path: str, recover: bool = True):
+        """
+        Near-constant-time load: the snapshot index is memory-mapped when faiss
+        supports it and texts/metadata are decoded lazily per hit, so processes
+        loading the same files share pages through the OS cache. Delta segments
+        appended since the last compaction go into a small flat index.
+        Unfinished segment writes left by a crash are discarded, unless
+        recover=False (readers that may run alongside another process's write).
+        """
+        log = SegmentLog(file_path)
+        manifest = log.read_manifest()
+        if manifest is None:
+            return self._load_old_format(file_path)
+        if recover:
+            log.recover(manifest)
+
+        self.index_spec = manifest['index_spec']
+        self.nprobe = manifest['nprobe']
+        self.ef_search = manifest['ef_search']
+        self.migrate_threshold = manifest['migrate_threshold']
+        self.storage = manifest.get('storage', 'float32')
+        self.rescore_factor = manifest.get('rescore_factor')
+
+        segments = manifest['segments']
+        names = [segment['name'] for segment in segments]
+        main = self._read_index(os.path.join(log.segment_path(names[0]), 'index.faiss'))
+        segment_vectors = [log.load_vectors(name) for name in names]
+        delta = self._delta_for(main, segment_vectors[1:])
+
+        id_parts, first_id = [], 0
+        for segment in segments:
+            ids = log.load_ids(segment['name'], first_id, segment['count'])
+            id_parts.append(ids)
+            first_id = int(ids[-1]) + 1 if len(ids) else first_id
+
+        self._indexes = (main, delta)
+        self._index_mapped = MMAP_FLAG is not None
+        self.texts = ChunkRegistry([os.path.join(log.segment_path(name), 'texts') for name in names],
+                                   overlap=self.chunk_overlap)
+        self.metadata = json_column([os.path.join(log.segment_path(name), 'meta') for name in names])
+        self._unsaved = []
+        self._segment_vectors = segment_vectors
+        self._persisted = manifest['count']
+        self._log = log
+        self._segment_count = len(names)
+        self._base_ids = np.concatenate(id_parts)
+        self._next_id = manifest.get('next_id', first_id)
+        self._tail_first_id = self._next_id
+        self._deleted_ids = {int(i) for i in log.load_tombstones(manifest)}
+        self._tombstone_version += 1
+        self._tombstones_saved = self._tombstone_version
+
+    def _load_old_format(self, file_path: str):
+        "Read the earlier snapshot/pickle formats; the next save rewrites them as segments"
+        if os.path.exists(file_path + '.json'):
+            with open(file_path + '.json', 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            index = self._read_index(file_path + '.index')
+            self.texts = ChunkRegistry([file_path + '.texts'], overlap=self.chunk_overlap)
+            self.metadata = json_column([file_path + '.meta'])
+            self._index_mapped = MMAP_FLAG is not None
+        else:
+            index = faiss.read_index(file_path + '.index')
+            with open(file_path + '_data.pkl', 'rb') as f:
+                data = pickle.load(f)
+            self.texts = ChunkRegistry(overlap=self.chunk_overlap)
+            self.texts.extend(data['texts'])
+            self.metadata = json_column()
+            self.metadata.extend(data['metadata'])
+            config = data.get('config') or {}
+            self._index_mapped = False
+
+        self.index_spec = config.get('index_spec', self.index_spec)
+        self.nprobe = config.get('nprobe', self.nprobe)
+        self.ef_search = config.get('ef_search', self.ef_search)
+        self.migrate_threshold = config.get('migrate_threshold', self.migrate_threshold)
+        self._indexes = (index, None)
+        self._apply_search_params()
+        self._unsaved = []
+        self._segment_vectors = []
+        self._persisted = len(self.texts)
+        self._log = None
+        self._segment_count = 0
+        # Older formats had no ids: a chunk's id is its row number
+        self._base_ids = np.arange(len(self.texts), dtype=np.int64)
+        self._next_id = len(self.texts)
+        self._tail_first_id = self._next_id
+        self._deleted_ids = set()
+        self._tombstone_version += 1
+        self._tombstones_saved = self._tombstone_version
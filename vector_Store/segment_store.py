@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+from typing import Callable, Iterable, List, Optional
+import faiss
+import numpy as np
+from .column_store import write_column
+
+MANIFEST_FORMAT = 3
+
+
+def _fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # directories cannot be fsynced on every platform
+    finally:
+        os.close(fd)
+
+
+class SegmentLog:
+    """
+    Append-only, log-structured layout of a FaissStore saved at <base>:
+
+        <base>.json                    manifest, the single commit point
+        <base>.segments/seg-000001/    vectors.npy, ids.npy, texts.bin/.docs/.spans
+                                       (chunk registry), meta.bin/.off and
+                                       index.faiss for the snapshot segment
+        <base>.segments/tombstones-000002.npy
+                                       chunk ids deleted since the last compaction
+
+    The first segment listed in the manifest carries a faiss snapshot covering
+    its rows; later segments are deltas appended by each save. A segment
+    directory is complete before the manifest that references it is renamed
+    into place, so anything not listed in the manifest after a crash is an
+    unfinished write and is removed by recover().
+    """
+
+    def __init__(self, base: str):
+        self.base = base
+        self.manifest_path = base + ".json"
+        self.segments_dir = base + ".segments"
+
+    def segment_path(self, name: str) -> str:
+        return os.path.join(self.segments_dir, name)
+
+    def read_manifest(self) -> Optional[dict]:
+        "The committed manifest, or None if there is no segment-format store here"
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != MANIFEST_FORMAT:
+            return None
+        return manifest
+
+    def write_manifest(self, manifest: dict):
+        manifest["format"] = MANIFEST_FORMAT
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        _fsync_path(os.path.dirname(os.path.abspath(self.manifest_path)))
+
+    def new_segment_name(self, manifest: Optional[dict]) -> str:
+        number = manifest["next_segment"] if manifest else 1
+        return f"seg-{number:06d}"
+
+    def write_segment(self, name: str, dimension: int, vector_parts: List[np.ndarray], ids: np.ndarray,
+                      write_texts: Callable[[str], int], metadata: Iterable[bytes], index=None) -> str:
+        """
+        Write a complete segment directory under a temporary name, then rename
+        it into place. write_texts(path) persists the segment's chunk texts at path.
+        """
+        path = self.segment_path(name)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        rows = sum(len(part) for part in vector_parts)
+        vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode="w+",
+                                            dtype=np.float32, shape=(rows, dimension))
+        start = 0
+        for part in vector_parts:
+            vectors[start:start + len(part)] = part
+            start += len(part)
+        vectors.flush()
+        del vectors
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(ids, dtype=np.int64))
+
+        write_texts(os.path.join(tmp_path, "texts"))
+        write_column(os.path.join(tmp_path, "meta"), metadata)
+        if index is not None:
+            faiss.write_index(index, os.path.join(tmp_path, "index.faiss"))
+
+        for file_name in os.listdir(tmp_path):
+            _fsync_path(os.path.join(tmp_path, file_name))
+        os.replace(tmp_path, path)
+        _fsync_path(self.segments_dir)
+        return path
+
+    def load_vectors(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.segment_path(name), "vectors.npy"), mmap_mode="r")
+
+    def load_ids(self, name: str, first_id: int, count: int) -> np.ndarray:
+        "Chunk ids of a segment; segments written before ids existed used row numbers"
+        path = os.path.join(self.segment_path(name), "ids.npy")
+        if not os.path.exists(path):
+            return np.arange(first_id, first_id + count, dtype=np.int64)
+        return np.load(path)
+
+    def write_tombstones(self, manifest: Optional[dict], ids: Iterable[int]) -> str:
+        "Write the full set of pending deleted ids to a new file; returns its name"
+        number = manifest["next_segment"] if manifest else 1
+        name = f"tombstones-{number:06d}.npy"
+        os.makedirs(self.segments_dir, exist_ok=True)
+        tmp_path = self.segment_path(name) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.fromiter(sorted(ids), dtype=np.int64))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.segment_path(name))
+        return name
+
+    def load_tombstones(self, manifest: dict) -> np.ndarray:
+        name = manifest.get("tombstones")
+        if not name:
+            return np.empty(0, dtype=np.int64)
+        return np.load(self.segment_path(name))
+
+    def recover(self, manifest: dict):
+        "Drop temporary and unreferenced segment files left by an interrupted write"
+        if not os.path.isdir(self.segments_dir):
+            return
+        live = {segment["name"] for segment in manifest["segments"]}
+        live.add(manifest.get("tombstones"))
+        for entry in os.listdir(self.segments_dir):
+            if entry not in live:
+                print(f"🧹 Removing incomplete segment {entry}")
+                self.remove_segments([entry])
+
+    def remove_segments(self, names: Iterable[str]):
+        for name in names:
+            path = self.segment_path(name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)